@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# SCP-079-CLEAN - Filter specific types of messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-CLEAN.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import pickle
+import sys
+from argparse import ArgumentParser
+from collections import Counter
+from configparser import RawConfigParser
+from os import chdir, getcwd, mkdir
+from os.path import abspath, dirname, join
+from random import Random
+from re import finditer
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Lock
+from time import perf_counter, sleep, time
+from typing import Dict, List
+
+from pyrogram import Chat, Message, MessageEntity, User
+
+# Replay messages through the message handlers offline, the bot runs in a temporary directory with a stub client,
+# the report has the throughput, the latency and the API calls of every stage, and the regressions against a baseline
+# Usage: python3 benchmark.py [--corpus FILE] [--count N] [--baseline FILE] [--save]
+
+# The directory of the repository
+root = dirname(abspath(__file__))
+
+# The chats and the users of the synthetic corpus
+exchange_id = -1001000000003
+group_ids = [-1001000000101, -1001000000102, -1001000000103, -1001000000104]
+user_ids = list(range(200000001, 200000201))
+
+# Rules of the synthetic corpus, saved to the temporary data directory before the bot starts
+rules = {
+    "ad": ["(?# nocr)cheap.*followers", "buy.*(?:likes|views)"],
+    "ban": ["scam.*bitcoin"],
+    "del": ["casino", "betting"],
+    "iml": ["instagram\\.com"],
+    "nm": ["free.*crypto"],
+    "sho": ["bit\\.ly", "goo\\.gl", "tinyurl\\.com"],
+    "tgl": ["t\\.me/", "telegram\\.me/"],
+    "tgp": ["proxy\\?server=", "socks\\?server="]
+}
+
+# Texts of the synthetic group messages, "{}" is replaced by a random number
+texts = [
+    "good morning everyone",
+    "does anyone know how to fix this build error {}",
+    "thanks, that works",
+    "see the docs at https://example.com/page/{}",
+    "join us https://t.me/joinchat/AAAA{}",
+    "https://t.me/proxy?server=1.2.3.{}&port=443&secret=ee",
+    "short link https://bit.ly/x{}",
+    "cheap instagram followers, buy likes and views {}",
+    "\U0001F600\U0001F600\U0001F600\U0001F600\U0001F600\U0001F600\U0001F600\U0001F600\U0001F600\U0001F600",
+    "/start@SomeBot {}",
+    "new casino bonus {}",
+    "what time is the meeting tomorrow?",
+    "lol",
+    "I think the release is on {} June",
+    "check instagram.com/user{}"
+]
+
+
+class StubClient:
+    # The client that records the API calls instead of sending them
+
+    def __init__(self):
+        self.calls = Counter()
+        self.lock = Lock()
+        self.message_id = 0
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            with self.lock:
+                self.calls[name] += 1
+
+            return self.reply(name, args, kwargs)
+
+        return call
+
+    def get_message(self, cid: int) -> Message:
+        # Get a message as if it was sent by the bot
+        with self.lock:
+            self.message_id += 1
+            mid = self.message_id
+
+        return Message(
+            client=self,
+            message_id=mid,
+            date=int(time()),
+            chat=Chat(client=self, id=cid, type="channel")
+        )
+
+    def reply(self, name: str, args: tuple, kwargs: dict):
+        # Get the result of the API call, the calls that return nothing useful get None
+        cid = kwargs.get("chat_id", args and args[0])
+
+        if name in {"send_cached_media", "send_document", "send_message"}:
+            return self.get_message(cid)
+
+        if name == "get_chat":
+            return Chat(client=self, id=cid, type="supergroup", title="Benchmark")
+
+        if name in {"delete_messages", "kick_chat_member", "restrict_chat_member", "unban_chat_member"}:
+            return True
+
+        return None
+
+
+def get_config(path: str) -> bool:
+    # Write the config of the benchmark from the example config
+    config = RawConfigParser()
+    config.read(join(root, "config.ini.example"))
+    values = {
+        "api_id": "1",
+        "api_hash": "0" * 32,
+        "bot_token": "123456789:BENCHMARK",
+        "exchange_channel_id": str(exchange_id),
+        "key": "benchmark",
+        "password": "benchmark",
+        "storage": "pickle",
+        "time_digest": "1"
+    }
+    the_id = 100000001
+
+    for section in config.sections():
+        for option, value in config.items(section):
+            if option in values:
+                config.set(section, option, values[option])
+            elif value == "[DATA EXPUNGED]" and (option.endswith("_channel_id") or option == "test_group_id"):
+                config.set(section, option, str(-1001000000000 - the_id))
+                the_id += 1
+            elif value == "[DATA EXPUNGED]":
+                config.set(section, option, str(the_id))
+                the_id += 1
+
+    with open(path, "w") as f:
+        config.write(f)
+
+    return True
+
+
+def get_corpus(count: int, seed: int) -> List[Message]:
+    # Get the synthetic messages, most of them are group messages, the others are joins and exchange data,
+    # the messages have no client, so they can be saved as a corpus
+    random = Random(seed)
+    mids = Counter()
+    result = []
+
+    for _ in range(count):
+        kind = random.random()
+        uid = random.choice(user_ids)
+        user = User(id=uid, is_self=False, is_bot=False, is_deleted=False,
+                    first_name=random.choice(["Alice", "Bob", "Carol", "free crypto", "Dave"]))
+
+        if kind < 0.1:
+            data = random.choice([
+                {"from": "NOSPAM", "to": ["CLEAN"], "action": "update", "type": "score",
+                 "data": {"id": uid, "score": round(random.random(), 1)}},
+                {"from": "NOPORN", "to": ["CLEAN"], "action": "add", "type": "bad",
+                 "data": {"id": uid, "type": "user"}},
+                {"from": "NOFLOOD", "to": ["CLEAN"], "action": "update", "type": "declare",
+                 "data": {"group_id": random.choice(group_ids), "message_id": random.randint(1, count)}}
+            ])
+            chat = Chat(id=exchange_id, type="channel")
+            text = json.dumps(data)
+            user = None
+        else:
+            chat = Chat(id=random.choice(group_ids), type="supergroup", title="Benchmark")
+            text = random.choice(texts).format(random.randint(1, 9999))
+
+        mids[chat.id] += 1
+        message = Message(message_id=mids[chat.id], date=int(time()), chat=chat, from_user=user)
+
+        if kind < 0.1:
+            message.text = text
+        elif kind < 0.15:
+            message.new_chat_members = [user]
+            message.service = True
+        else:
+            message.text = text
+            message.entities = [MessageEntity(type="url", offset=m.start(), length=len(m.group()))
+                                for m in finditer(r"\S*(?:https?://|t\.me/|instagram\.com)\S*", text)] or None
+
+        result.append(message)
+
+    return result
+
+
+def get_percentile(values: List[float], percent: float) -> float:
+    # Get the percentile by the nearest rank
+    if not values:
+        return 0.0
+
+    values = sorted(values)
+
+    return values[min(len(values) - 1, max(0, int(len(values) * percent / 100 + 0.5) - 1))]
+
+
+def get_report(results: Dict[str, dict], baseline: Dict[str, dict], tolerance: float, floor: float) -> (str, bool):
+    # Get the text of the results, and whether there is any regression against the baseline
+    lines = [f"{'stage':<14}{'messages':>10}{'filtered':>10}{'msg/s':>12}{'p50 ms':>10}{'p95 ms':>10}"
+             f"{'p99 ms':>10}{'calls/msg':>11}"]
+    regressed = False
+
+    for stage, result in results.items():
+        lines.append(f"{stage:<14}{result['messages']:>10}{result['filtered']:>10}{result['rate']:>12.1f}"
+                     f"{result['p50']:>10.3f}{result['p95']:>10.3f}{result['p99']:>10.3f}{result['calls']:>11.3f}")
+
+        if result["methods"]:
+            lines.append(" " * 14 + ", ".join(f"{k}: {v}" for k, v in sorted(result["methods"].items())))
+
+        old = baseline.get(stage)
+
+        if not old:
+            continue
+
+        for metric in ["rate", "p50", "p95", "p99", "calls"]:
+            if not old.get(metric):
+                continue
+
+            change = result[metric] / old[metric] - 1
+
+            # The latency of a few microseconds is mostly noise
+            if metric.startswith("p") and result[metric] - old[metric] < floor:
+                continue
+
+            # Lower rate is worse, higher latency and more calls are worse
+            if (metric == "rate" and change < -tolerance) or (metric != "rate" and change > tolerance):
+                regressed = True
+                lines.append(" " * 14 + f"REGRESSION {metric}: {old[metric]:.3f} -> {result[metric]:.3f} "
+                                        f"({change:+.1%})")
+
+    return "\n".join(lines), regressed
+
+
+def get_stages() -> Dict[str, tuple]:
+    # Get the handlers' filters and the work of the stages, the check handler only passes the message to a queue,
+    # so the work of the check stage is check_message
+    from plugins.handlers.message import check, check_join, check_message, process_data
+
+    return {
+        "check": (check.handler[0], check_message),
+        "check_join": (check_join.handler[0], check_join),
+        "process_data": (process_data.handler[0], process_data)
+    }
+
+
+def get_stage(message: Message) -> str:
+    # Get the stage of the message
+    if message.chat.id == exchange_id:
+        return "process_data"
+    elif message.new_chat_members:
+        return "check_join"
+    else:
+        return "check"
+
+
+def init_bot(path: str) -> bool:
+    # Prepare the config and the data of the bot, then start the bot's modules in the directory
+    get_config(join(path, "config.ini"))
+    mkdir(join(path, "data"))
+
+    for word_type, words in rules.items():
+        with open(join(path, "data", f"{word_type}_words"), "wb") as f:
+            pickle.dump({word: 0 for word in words}, f)
+
+    chdir(path)
+    sys.path.insert(0, root)
+
+    from plugins import glovar
+    from plugins.functions.ids import init_group_id
+
+    # The rate limiting paces the real API, it is not the cost of the bot
+    for method in glovar.api_limits:
+        glovar.api_limits[method] = (1e9, 1e9)
+
+    for i, gid in enumerate(group_ids):
+        init_group_id(gid)
+        glovar.admin_ids[gid] = {glovar.clean_id, glovar.user_id}
+
+        # Half of the groups work with NOSPAM
+        i % 2 and glovar.admin_ids[gid].add(glovar.nospam_id)
+
+        glovar.configs[gid].update({t: True for t in ["bmd", "emo", "iml", "sde", "sho", "tgl", "tgp"]})
+
+    return True
+
+
+def run(client: StubClient, messages: List[Message], settle: float) -> Dict[str, dict]:
+    # Run the messages stage by stage, the API calls made in the background are counted after the stage settles
+    stages = get_stages()
+    results = {}
+
+    for stage, (handler, work) in stages.items():
+        latencies = []
+        filtered = 0
+        client.calls.clear()
+
+        for message in (m for m in messages if get_stage(m) == stage):
+            message._client = client
+            start = perf_counter()
+
+            if handler.check(message):
+                work(client, message)
+            else:
+                filtered += 1
+
+            latencies.append(perf_counter() - start)
+
+        wait_idle(settle)
+        count = len(latencies)
+        results[stage] = {
+            "messages": count,
+            "filtered": filtered,
+            "rate": count / sum(latencies) if count and sum(latencies) else 0.0,
+            "p50": get_percentile(latencies, 50) * 1000,
+            "p95": get_percentile(latencies, 95) * 1000,
+            "p99": get_percentile(latencies, 99) * 1000,
+            "calls": sum(client.calls.values()) / count if count else 0.0,
+            "methods": dict(client.calls)
+        }
+
+    return results
+
+
+def wait_idle(timeout: float) -> bool:
+    # Wait for the thread pools, the serial queues and the delayed calls to finish
+    from plugins import glovar
+
+    end = time() + timeout
+
+    while time() < end:
+        with glovar.locks["pool"]:
+            busy = any(s["pending"] or s["running"] for s in glovar.pool_stats.values())
+
+        if not busy and not glovar.serials and not glovar.delay_tasks:
+            return True
+
+        sleep(0.05)
+
+    return False
+
+
+def main() -> int:
+    # Parse the arguments, run the benchmark, compare the results with the baseline
+    parser = ArgumentParser(description="Replay messages through the message handlers offline")
+    parser.add_argument("--corpus", help="pickle file of a list of recorded pyrogram Message objects without clients")
+    parser.add_argument("--count", type=int, default=5000, help="number of synthetic messages")
+    parser.add_argument("--seed", type=int, default=0, help="seed of the synthetic messages")
+    parser.add_argument("--warmup", type=int, default=200, help="number of messages that are not measured")
+    parser.add_argument("--settle", type=float, default=30.0, help="seconds to wait for the background calls")
+    parser.add_argument("--baseline", default=join(root, "benchmark.json"), help="file of the baseline")
+    parser.add_argument("--save", action="store_true", help="save the results as the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative change of the baseline")
+    parser.add_argument("--floor", type=float, default=0.05, help="ignored latency change in milliseconds")
+    parser.add_argument("--keep", action="store_true", help="keep the temporary directory")
+    args = parser.parse_args()
+
+    # The bot changes the working directory, the relative paths are resolved before it
+    cwd = getcwd()
+    args.baseline = join(cwd, args.baseline)
+    args.corpus = args.corpus and join(cwd, args.corpus)
+    path = mkdtemp(prefix="benchmark-")
+
+    try:
+        init_bot(path)
+        client = StubClient()
+
+        if args.corpus:
+            with open(args.corpus, "rb") as f:
+                messages = pickle.load(f)
+        else:
+            messages = get_corpus(args.count + args.warmup, args.seed)
+
+        run(client, messages[:args.warmup], args.settle)
+        results = run(client, messages[args.warmup:], args.settle)
+
+        try:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        except FileNotFoundError:
+            baseline = {}
+
+        text, regressed = get_report(results, baseline, args.tolerance, args.floor)
+        print(text)
+
+        with open(join(path, "log")) as f:
+            warnings = sum(" - WARNING - " in line or " - ERROR - " in line for line in f)
+
+        warnings and print(f"Warnings in the log: {warnings}" + (f", see {join(path, 'log')}" if args.keep else ""))
+
+        if args.save:
+            with open(args.baseline, "w") as f:
+                json.dump(results, f, indent=4)
+
+            print(f"Saved the baseline to {args.baseline}")
+
+        return 1 if regressed and not args.save else 0
+    finally:
+        chdir(cwd)
+
+        if args.keep:
+            print(f"Kept {path}")
+        else:
+            rmtree(path, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
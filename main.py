@@ -22,41 +22,71 @@
 import logging
 from random import randint
 
-from apscheduler.schedulers.background import BackgroundScheduler
-from pyrogram import Client
-
-from plugins import glovar
-from plugins.functions.timers import backup_files, clean_banned, clean_members, interval_hour_01, interval_min_10
-from plugins.functions.timers import reset_data, send_count, update_admins, update_status
-
-# Enable logging
-logger = logging.getLogger(__name__)
-
-# Config session
-app = Client(
-    session_name="bot",
-    bot_token=glovar.bot_token
-)
-app.start()
-
-# Send online status
-update_status(app, "online")
-
-# Timer
-scheduler = BackgroundScheduler(job_defaults={"misfire_grace_time": 60})
-scheduler.add_job(interval_hour_01, "interval", [app], hours=1)
-scheduler.add_job(interval_min_10, "interval", minutes=10)
-scheduler.add_job(update_status, "cron", [app, "awake"], minute=randint(30, 34), second=randint(0, 59))
-scheduler.add_job(clean_members, "cron", [app], hour=2)
-scheduler.add_job(clean_banned, "cron", [app], hour=3)
-scheduler.add_job(backup_files, "cron", [app], hour=20)
-scheduler.add_job(send_count, "cron", [app], hour=21)
-scheduler.add_job(reset_data, "cron", [app], day=glovar.date_reset, hour=22)
-scheduler.add_job(update_admins, "cron", [app], hour=22, minute=30)
-scheduler.start()
-
-# Hold
-app.idle()
-
-# Stop
-app.stop()
+# The QR code workers are spawned from this file, only the main process runs the bot
+if __name__ == "__main__":
+    from apscheduler.schedulers.background import BackgroundScheduler
+    from pyrogram import Client
+
+    from plugins import glovar
+    from plugins.functions.channel import send_digest
+    from plugins.functions.file import save_dirty
+    from plugins.functions.group import delete_flush
+    from plugins.functions.image import stop_qrcode_workers
+    from plugins.functions.regex import save_regex_count
+    from plugins.functions.timers import backup_files, clean_banned, clean_members, interval_hour_01, interval_min_01
+    from plugins.functions.timers import interval_min_10, reset_data, send_count, update_admins, update_status
+
+    # Enable logging
+    logger = logging.getLogger(__name__)
+
+    # Config session
+    app = Client(
+        session_name="bot",
+        bot_token=glovar.bot_token
+    )
+    app.start()
+
+    # Send online status
+    update_status(app, "online")
+
+    # Timer
+    scheduler = BackgroundScheduler(job_defaults={"misfire_grace_time": 60})
+    scheduler.add_job(save_dirty, "interval", seconds=glovar.time_save)
+    scheduler.add_job(interval_hour_01, "interval", [app], hours=1)
+    scheduler.add_job(interval_min_01, "interval", minutes=1)
+    scheduler.add_job(interval_min_10, "interval", minutes=10)
+    scheduler.add_job(update_status, "cron", [app, "awake"], minute=randint(30, 34), second=randint(0, 59))
+    scheduler.add_job(clean_members, "cron", [app], hour=2)
+    scheduler.add_job(clean_banned, "cron", [app], hour=3)
+    scheduler.add_job(backup_files, "cron", [app], hour=20)
+    scheduler.add_job(send_count, "cron", [app], hour=21)
+    scheduler.add_job(reset_data, "cron", [app], day=glovar.date_reset, hour=22)
+    scheduler.add_job(update_admins, "cron", [app], hour=22, minute=30)
+    scheduler.start()
+
+    # Hold
+    app.idle()
+
+    # Stop
+    scheduler.shutdown()
+
+    # Drain the pools before stopping the client, the decoding and the checks may still submit to the others
+    stop_qrcode_workers()
+    glovar.pools["check"].shutdown()
+
+    # Flush the buffered deletions and debug notices
+    for gid in list(glovar.deletions):
+        delete_flush(app, gid)
+
+    for gid in list(glovar.digests):
+        send_digest(app, gid)
+
+    for pool in ["api", "low", "io"]:
+        glovar.pools[pool].shutdown()
+
+    app.stop()
+
+    # Save
+    save_regex_count()
+    save_dirty()
+    glovar.database and glovar.database.close()
@@ -18,17 +18,19 @@
 
 import logging
 from json import dumps
-from typing import List, Optional, Union
+from threading import Lock
+from time import time
+from typing import Dict, List, Optional, Tuple, Union
 
 from pyrogram import Chat, Client, Message
 from pyrogram.errors import FloodWait
 
 from .. import glovar
-from .etc import code, code_block, general_link, get_forward_name, get_full_name, get_md5sum, get_text, lang
-from .etc import message_link, thread, wait_flood
+from .etc import code, code_block, general_link, get_feature, get_forward_name, get_full_name, get_md5sum, get_text
+from .etc import delay, lang, message_link, set_feature, t2t, thread, wait_api, wait_flood
 from .file import crypt_file, data_to_file, delete_file, get_new_path, save
 from .image import get_file_id
-from .telegram import get_group_info, send_document, send_message
+from .telegram import forward_messages, get_chat, send_cached_media, send_document, send_message
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -130,6 +132,78 @@ def format_data(sender: str, receivers: List[str], action: str, action_type: str
     return text
 
 
+def flush_evidence(client: Client, gid: int, forward: bool) -> bool:
+    # Forward the queued evidence of the group together if the messages are not deleted yet,
+    # send the copies of the rest, the reports and the debug notices in a thread
+    try:
+        with glovar.locks["evidence"]:
+            items = glovar.evidences.pop(gid, [])
+
+        if not items:
+            return True
+
+        reports = []
+        forwards = {}
+
+        for item in items:
+            channel_id, message, text, debug = item
+
+            # Forwarding is unnecessary
+            if debug[3] in glovar.types["basic"]:
+                reports.append((channel_id, message, message, "", debug))
+
+            # DO NOT try to forward these types of message
+            elif (message.contact
+                  or message.location
+                  or message.venue
+                  or message.video_note
+                  or message.voice
+                  or message.game
+                  or message.service):
+                reports.append((channel_id, message, False, text, debug))
+
+            # The message is already deleted, send the copy instead
+            elif not forward:
+                reports.append((channel_id, message, None, text, debug))
+
+            else:
+                forwards.setdefault(channel_id, []).append(item)
+
+        # Forward up to 100 messages in one request
+        for channel_id, the_items in forwards.items():
+            for i in range(0, len(the_items), 100):
+                batch = the_items[i:i + 100]
+
+                # The deletion does not wait for the throttled channel, send the copies later instead
+                flood = max(glovar.api_floods.get(key, 0) for key in [("forward_messages", channel_id), ("", 0)])
+
+                if flood > time():
+                    ems = None
+                else:
+                    ems = forward_messages(client, channel_id, gid, [item[1].message_id for item in batch])
+
+                # Send the copies if the request failed
+                if ems is None:
+                    ems = [None] * len(batch)
+
+                # Some messages were not forwarded, the reports cannot be matched to the evidence
+                if len(ems) != len(batch):
+                    logger.info(f"Forward evidence {len(ems)} of {len(batch)} messages in {gid}")
+                    ems = [False] * len(batch)
+
+                for item, em in zip(batch, ems):
+                    channel_id, message, text, debug = item
+                    reports.append((channel_id, message, em, text, debug))
+
+        thread(send_evidence, (client, gid, reports), "low")
+
+        return True
+    except Exception as e:
+        logger.warning(f"Flush evidence error: {e}", exc_info=True)
+
+    return False
+
+
 def forward_evidence(client: Client, message: Message, level: str, rule: str, the_type: str, score: float = 0.0,
                      more: str = None, general: bool = True) -> Optional[Union[bool, Message]]:
     # Forward the message to the channel as evidence
@@ -137,53 +211,14 @@ def forward_evidence(client: Client, message: Message, level: str, rule: str, th
 
     try:
         # Get channel id
-        channel_id = glovar.logging_channel_id if general else glovar.clean_channel_id
-
-        # TODO temp
-        if not channel_id:
-            channel_id = glovar.logging_channel_id
+        channel_id = get_evidence_channel(general)
 
         # Forwarding is unnecessary
         if the_type in glovar.types["basic"]:
             return message
 
         # Basic information
-        uid = message.from_user.id
-        text = (f"{lang('project')}{lang('colon')}{code(glovar.sender)}\n"
-                f"{lang('user_id')}{lang('colon')}{code(uid)}\n"
-                f"{lang('level')}{lang('colon')}{code(level)}\n"
-                f"{lang('rule')}{lang('colon')}{code(rule)}\n")
-
-        # Additional information
-        if the_type:
-            text += f"{lang('message_type')}{lang('colon')}{code(lang(the_type))}\n"
-
-        if message.game:
-            text += f"{lang('message_game')}{lang('colon')}{code(message.game.short_name)}\n"
-
-        if lang("score") in rule:
-            text += f"{lang('user_score')}{lang('colon')}{code(f'{score:.1f}')}\n"
-
-        if lang("name") in rule:
-            name = get_full_name(message.from_user)
-
-            if name:
-                text += f"{lang('user_name')}{lang('colon')}{code(name)}\n"
-
-            forward_name = get_forward_name(message)
-
-            if forward_name and forward_name != name:
-                text += f"{lang('from_name')}{lang('colon')}{code(forward_name)}\n"
-
-        # Extra information
-        if the_type in {"clean", "pur", "sde"}:
-            text += f"{lang('more')}{lang('colon')}{code(lang(f'{the_type}_more'))}\n"
-        elif message.contact or message.location or message.venue or message.video_note or message.voice:
-            text += f"{lang('more')}{lang('colon')}{code(lang('privacy'))}\n"
-        elif message.game or message.service:
-            text += f"{lang('more')}{lang('colon')}{code(lang('cannot_forward'))}\n"
-        elif more:
-            text += f"{lang('more')}{lang('colon')}{code(more)}\n"
+        text = get_evidence_text(message, level, rule, the_type, score, more)
 
         # DO NOT try to forward these types of message
         if (message.contact
@@ -201,13 +236,14 @@ def forward_evidence(client: Client, message: Message, level: str, rule: str, th
         while flood_wait:
             flood_wait = False
             try:
+                wait_api("forward_messages", channel_id)
                 result = message.forward(
                     chat_id=channel_id,
                     disable_notification=True
                 )
             except FloodWait as e:
                 flood_wait = True
-                wait_flood(e)
+                wait_flood(e, "forward_messages", channel_id)
             except Exception as e:
                 logger.info(f"Forward evidence message error: {e}", exc_info=True)
                 return False
@@ -228,6 +264,13 @@ def get_content(message: Message) -> str:
         if not message:
             return ""
 
+        # Get the cached content
+        result = get_feature(message, "content")
+
+        if result is not None:
+            return result
+
+        result = ""
         file_id, _, _ = get_file_id(message)
         text = get_text(message)
 
@@ -245,6 +288,8 @@ def get_content(message: Message) -> str:
 
         if text:
             result += get_md5sum("string", text)
+
+        set_feature(message, "content", result)
     except Exception as e:
         logger.warning(f"Get content error: {e}", exc_info=True)
 
@@ -283,19 +328,181 @@ def get_debug_text(client: Client, context: Union[int, Chat, List[int]]) -> str:
     return text
 
 
-def send_debug(client: Client, chat: Chat, action: str, uid: int, mid: int, em: Message,
+def get_evidence_channel(general: bool) -> int:
+    # Get the channel id of the evidence
+    result = 0
+    try:
+        result = glovar.logging_channel_id if general else glovar.clean_channel_id
+
+        # TODO temp
+        if not result:
+            result = glovar.logging_channel_id
+    except Exception as e:
+        logger.warning(f"Get evidence channel error: {e}", exc_info=True)
+
+    return result
+
+
+def get_evidence_text(message: Message, level: str, rule: str, the_type: str, score: float = 0.0,
+                      more: str = None) -> str:
+    # Get the report text of the evidence
+    text = ""
+    try:
+        # Basic information
+        uid = message.from_user.id
+        text = (f"{lang('project')}{lang('colon')}{code(glovar.sender)}\n"
+                f"{lang('user_id')}{lang('colon')}{code(uid)}\n"
+                f"{lang('level')}{lang('colon')}{code(level)}\n"
+                f"{lang('rule')}{lang('colon')}{code(rule)}\n")
+
+        # Additional information
+        if the_type:
+            text += f"{lang('message_type')}{lang('colon')}{code(lang(the_type))}\n"
+
+        if message.game:
+            text += f"{lang('message_game')}{lang('colon')}{code(message.game.short_name)}\n"
+
+        if lang("score") in rule:
+            text += f"{lang('user_score')}{lang('colon')}{code(f'{score:.1f}')}\n"
+
+        if lang("name") in rule:
+            name = get_full_name(message.from_user)
+
+            if name:
+                text += f"{lang('user_name')}{lang('colon')}{code(name)}\n"
+
+            forward_name = get_forward_name(message)
+
+            if forward_name and forward_name != name:
+                text += f"{lang('from_name')}{lang('colon')}{code(forward_name)}\n"
+
+        # Extra information
+        if the_type in {"clean", "pur", "sde"}:
+            text += f"{lang('more')}{lang('colon')}{code(lang(f'{the_type}_more'))}\n"
+        elif message.contact or message.location or message.venue or message.video_note or message.voice:
+            text += f"{lang('more')}{lang('colon')}{code(lang('privacy'))}\n"
+        elif message.game or message.service:
+            text += f"{lang('more')}{lang('colon')}{code(lang('cannot_forward'))}\n"
+        elif more:
+            text += f"{lang('more')}{lang('colon')}{code(more)}\n"
+    except Exception as e:
+        logger.warning(f"Get evidence text error: {e}", exc_info=True)
+
+    return text
+
+
+def get_group(client: Client, gid: int, cache: bool = True) -> Dict[str, Union[float, str]]:
+    # Get the group's metadata, only one request is sent for a group at the same time
+    result = {}
+    try:
+        started = time()
+        result = glovar.groups.get(gid, {})
+
+        if cache and result and started - result["time"] < glovar.time_group:
+            return result
+
+        with glovar.locks["group"]:
+            lock = glovar.group_locks.setdefault(gid, Lock())
+
+        with lock:
+            # The group may be updated while waiting
+            result = glovar.groups.get(gid, {})
+
+            if result and (result["time"] >= started or (cache and time() - result["time"] < glovar.time_group)):
+                return result
+
+            group = get_chat(client, gid)
+
+            # Keep the old data if the request failed
+            if not isinstance(group, Chat):
+                return result
+
+            result = get_group_data(group)
+            glovar.groups[gid] = result
+    except Exception as e:
+        logger.warning(f"Get group error: {e}", exc_info=True)
+
+    return result
+
+
+def get_group_data(group: Chat) -> Dict[str, Union[float, str]]:
+    # Get the used fields of the group
+    result = {}
+    try:
+        pinned_message = group.pinned_message
+        result = {
+            "time": time(),
+            "name": group.title or "",
+            "link": (group.username and f"https://t.me/{group.username}") or "",
+            "description": (group.description and t2t(group.description, False, False)) or "",
+            "pinned_content": get_content(pinned_message),
+            "pinned_text": get_text(pinned_message),
+            "sticker": group.sticker_set_name or ""
+        }
+    except Exception as e:
+        logger.warning(f"Get group data error: {e}", exc_info=True)
+
+    return result
+
+
+def get_group_info(client: Client, chat: Union[int, Chat], cache: bool = True) -> (str, str):
+    # Get a group's name and link
+    group_name = "Unknown Group"
+    group_link = glovar.default_group_link
+    try:
+        if isinstance(chat, Chat):
+            group_name = chat.title or group_name
+            group_link = (chat.username and f"https://t.me/{chat.username}") or group_link
+            return group_name, group_link
+
+        # The cached metadata of the group
+        group = get_group(client, chat, cache)
+        group_name = group.get("name") or group_name
+        group_link = group.get("link") or group_link
+    except Exception as e:
+        logger.info(f"Get group {chat} info error: {e}", exc_info=True)
+
+    return group_name, group_link
+
+
+def queue_evidence(message: Message, level: str, rule: str, the_type: str, action: str,
+                   score: float = 0.0, more: str = None, general: bool = True) -> bool:
+    # Queue the message as evidence, the queue of the group is flushed with the group's deletion
+    try:
+        gid = message.chat.id
+        channel_id = get_evidence_channel(general)
+        text = get_evidence_text(message, level, rule, the_type, score, more)
+        debug = (message.from_user.id, action, message.message_id, the_type)
+
+        with glovar.locks["evidence"]:
+            glovar.evidences.setdefault(gid, []).append((channel_id, message, text, debug))
+
+        return True
+    except Exception as e:
+        logger.warning(f"Queue evidence error: {e}", exc_info=True)
+
+    return False
+
+
+def send_debug(client: Client, chat: Union[int, Chat], action: str, uid: int, mid: int, em: Optional[Message],
                the_type: str = None) -> bool:
-    # Send the debug message
+    # Add the debug notice to the group's digest, the digest is sent after a short time
     try:
-        text = get_debug_text(client, chat)
-        text += (f"{lang('user_id')}{lang('colon')}{code(uid)}\n"
-                 f"{lang('action')}{lang('colon')}{code(action)}\n"
-                 f"{lang('triggered_by')}{lang('colon')}{general_link(mid, message_link(em))}\n")
+        gid = chat if isinstance(chat, int) else chat.id
+        link = em and message_link(em)
+        text = (f"{lang('user_id')}{lang('colon')}{code(uid)}\n"
+                f"{lang('action')}{lang('colon')}{code(action)}\n"
+                f"{lang('triggered_by')}{lang('colon')}{(link and general_link(mid, link)) or code(mid)}\n")
 
         if the_type:
             text += f"{lang('message_type')}{lang('colon')}{code(lang(the_type))}\n"
 
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        with glovar.locks["digest"]:
+            texts = glovar.digests.setdefault(gid, [])
+            texts.append(text)
+            first = len(texts) == 1
+
+        first and delay(glovar.time_digest, send_digest, [client, gid], None, "low")
 
         return True
     except Exception as e:
@@ -304,6 +511,79 @@ def send_debug(client: Client, chat: Chat, action: str, uid: int, mid: int, em:
     return False
 
 
+def send_digest(client: Client, gid: int) -> bool:
+    # Send the debug notices of the group in as few messages as possible
+    try:
+        with glovar.locks["digest"]:
+            texts = glovar.digests.pop(gid, [])
+
+        if not texts:
+            return True
+
+        prefix = get_debug_text(client, gid)
+        text = prefix
+
+        for notice in texts:
+            if text != prefix and len(text) + len(notice) > 4000:
+                send_message(client, glovar.debug_channel_id, text)
+                text = prefix
+
+            text += (text != prefix and "\n" or "") + notice
+
+        send_message(client, glovar.debug_channel_id, text)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Send digest error: {e}", exc_info=True)
+
+    return False
+
+
+def send_evidence(client: Client, gid: int,
+                  reports: List[Tuple[int, Message, Union[bool, Message, None], str, tuple]]) -> bool:
+    # Send the evidence, the reports and the debug notices
+    try:
+        for channel_id, message, em, text, debug in reports:
+            uid, action, mid, the_type = debug
+
+            # The message was not forwarded, send its local copy
+            if em is None:
+                em = send_evidence_copy(client, channel_id, message)
+
+            # Attach report message, or send the report alone if there is no evidence message
+            if text:
+                result = send_message(client, channel_id, text, (em and em.message_id) or None)
+                em = em or result
+
+            the_type = (lambda x: x if x in glovar.types["basic"] else None)(the_type)
+            send_debug(client, gid, action, uid, mid, em or None, the_type)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Send evidence error: {e}", exc_info=True)
+
+    return False
+
+
+def send_evidence_copy(client: Client, channel_id: int, message: Message) -> Union[bool, Message, None]:
+    # Send the copy of the message as evidence, it still works after the message is deleted
+    result = None
+    try:
+        text = get_text(message)
+        media = (message.animation or message.audio or message.document or message.photo or message.sticker
+                 or message.video or message.video_note or message.voice)
+
+        if media:
+            caption = (message.sticker and "") or code_block(text[:1000])
+            result = send_cached_media(client, channel_id, media.file_id, media.file_ref, caption)
+        elif text:
+            result = send_message(client, channel_id, code_block(text[:4000]))
+    except Exception as e:
+        logger.warning(f"Send evidence copy error: {e}", exc_info=True)
+
+    return result
+
+
 def share_bad_user(client: Client, uid: int) -> bool:
     # Share a bad user with other bots
     try:
@@ -408,7 +688,7 @@ def share_data_thread(client: Client, receivers: List[str], action: str, action_
 
         # Delete the tmp file
         for f in {file, file_path}:
-            f.startswith("tmp/") and thread(delete_file, (f,))
+            f.startswith("tmp/") and thread(delete_file, (f,), "io")
 
         return True
     except Exception as e:
@@ -471,7 +751,7 @@ def update_score(client: Client, uid: int) -> bool:
         count = len(glovar.user_ids[uid]["detected"])
         score = count * 0.6
         glovar.user_ids[uid]["score"][glovar.sender.lower()] = score
-        save("user_ids")
+        save("user_ids", uid)
         share_data(
             client=client,
             receivers=glovar.receivers["score"],
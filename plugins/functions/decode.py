@@ -0,0 +1,143 @@
+# SCP-079-CLEAN - Filter specific types of messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-CLEAN.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import signal
+from io import BytesIO
+from multiprocessing.connection import Connection
+
+from PIL import Image, ImageChops, ImageEnhance, ImageFilter
+from pyzbar.pyzbar import decode
+
+# This module also runs in the worker processes, DO NOT import glovar or other modules of the bot here
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+# Thresholding table of the gray image
+threshold = [0] * 150 + [255] * 106
+
+# Pre-screening: the size of the thumbnail, the size of its blocks, the least edge density of a block that looks like
+# the modules of QR codes, and the least number of such blocks
+screen_size = 256
+screen_block = 8
+screen_edge = 64
+screen_count = 6
+
+# Thresholding table of the blocks' edge density
+dense = [0] * screen_edge + [255] * (256 - screen_edge)
+
+# Thresholding table of the blocks' brightness, the modules of QR codes are both dark and light
+balanced = [0] * 64 + [255] * 128 + [0] * 64
+
+
+def decode_init() -> bool:
+    # Initialize the worker process, let the main process handle the interrupt
+    try:
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Decode init error: {e}", exc_info=True)
+
+    return False
+
+
+def decode_loop(conn: Connection) -> bool:
+    # Run in the worker process, decode the images from the connection one at a time, None means stop
+    try:
+        decode_init()
+
+        # Tell the main process that the worker is ready, the time of the job starts after this
+        conn.send(True)
+
+        while True:
+            data = conn.recv()
+
+            if data is None:
+                break
+
+            conn.send(decode_qrcode(data))
+
+        return True
+    except Exception as e:
+        logger.warning(f"Decode loop error: {e}", exc_info=True)
+
+    return False
+
+
+def decode_qrcode(data: bytes) -> str:
+    # Decode the QR codes in the image data
+    result = ""
+    try:
+        # Open
+        image = Image.open(BytesIO(data))
+
+        # Gray
+        image = image.convert("L")
+
+        # Contrast
+        image = ImageEnhance.Contrast(image).enhance(4.0)
+
+        # Thresholding
+        image = image.point(threshold)
+
+        # Decode
+        decoded_list = decode(image)
+
+        if decoded_list:
+            result = "\n".join(f"{decoded.data}" for decoded in decoded_list if decoded.type == "QRCODE")
+    except Exception as e:
+        logger.warning(f"Decode qrcode error: {e}", exc_info=True)
+
+    return result
+
+
+def screen_qrcode(data: bytes) -> bool:
+    # Check the thumbnail for the dense high-contrast structure of QR codes, False means no QR code to decode
+    result = True
+    try:
+        # Open, let the JPEG decoder scale down the image
+        image = Image.open(BytesIO(data))
+        image.draft("L", (screen_size, screen_size))
+
+        # Gray and thumbnail
+        image = image.convert("L")
+        image.thumbnail((screen_size, screen_size))
+        width, height = image.size
+
+        if width < screen_block * 4 or height < screen_block * 4:
+            return True
+
+        # The same contrast and thresholding as the full decoding
+        image = ImageEnhance.Contrast(image).enhance(4.0)
+        image = image.point(threshold)
+
+        # Edges, the outermost pixels are not filtered
+        box = (1, 1, width - 1, height - 1)
+        size = ((width - 2) // screen_block, (height - 2) // screen_block)
+        edges = image.filter(ImageFilter.FIND_EDGES).crop(box)
+
+        # Blocks with dense edges and balanced brightness
+        dense_blocks = edges.resize(size, Image.BOX).point(dense)
+        balanced_blocks = image.crop(box).resize(size, Image.BOX).point(balanced)
+        result = ImageChops.multiply(dense_blocks, balanced_blocks).histogram()[255] >= screen_count
+    except Exception as e:
+        logger.warning(f"Screen qrcode error: {e}", exc_info=True)
+
+    return result
@@ -18,20 +18,23 @@
 
 import logging
 import re
+from collections import deque
 from datetime import datetime
+from functools import lru_cache
 from hashlib import md5
+from heapq import heappop, heappush
 from html import escape
 from json import dumps
+from math import ceil
 from random import choice, uniform
 from re import sub
 from string import ascii_letters, digits
-from threading import Thread, Timer
-from time import localtime, sleep, strftime, time
-from typing import Any, Callable, Dict, List, Optional, Union
+from threading import Thread
+from time import localtime, strftime, time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Union
 from unicodedata import normalize
 
 from cryptography.fernet import Fernet
-from opencc import convert
 from pyrogram import Contact, InlineKeyboardMarkup, Message, MessageEntity, User
 from pyrogram.errors import FloodWait
 
@@ -116,20 +119,73 @@ def crypt_str(operation: str, text: str, key: bytes) -> str:
     return result
 
 
-def delay(secs: int, target: Callable, args: list) -> bool:
-    # Call a function with delay
+def delay(secs: int, target: Callable, args: list, key: Hashable = None, pool: str = "api") -> int:
+    # Call a function with delay in the pool, return the task id that can be cancelled
+    result = 0
+
     try:
-        t = Timer(secs, target, args)
-        t.daemon = True
-        t.start()
+        when = ceil(time() + secs)
 
-        return True
+        with glovar.delay_condition:
+            result = next(glovar.delay_ids)
+            glovar.delay_tasks[result] = (target, args, key, pool)
+            heappush(glovar.delays, (when, result))
+
+            # Start the timer thread at the first time
+            if not glovar.delay_thread:
+                glovar.delay_thread = Thread(target=delay_run, daemon=True)
+                glovar.delay_thread.start()
+
+            glovar.delay_condition.notify()
     except Exception as e:
         logger.warning(f"Delay error: {e}", exc_info=True)
 
+    return result
+
+
+def delay_cancel(task_id: int) -> bool:
+    # Cancel a delayed call
+    try:
+        with glovar.delay_condition:
+            return glovar.delay_tasks.pop(task_id, None) is not None
+    except Exception as e:
+        logger.warning(f"Delay cancel error: {e}", exc_info=True)
+
     return False
 
 
+def delay_run() -> bool:
+    # Run the due delayed calls in the thread pool, tasks with the same key in a tick are merged
+    while True:
+        try:
+            tasks = []
+
+            with glovar.delay_condition:
+                while not glovar.delays or glovar.delays[0][0] > time():
+                    glovar.delay_condition.wait(max(glovar.delays[0][0] - time(), 0) if glovar.delays else None)
+
+                while glovar.delays and glovar.delays[0][0] <= time():
+                    _, task_id = heappop(glovar.delays)
+                    task = glovar.delay_tasks.pop(task_id, None)
+                    task and tasks.append(task)
+
+            # Merge the last arguments, such as the message ids to delete
+            merged = {}
+
+            for target, args, key, pool in tasks:
+                if key is None:
+                    thread(target, tuple(args), pool)
+                elif key not in merged:
+                    merged[key] = (target, list(args), pool)
+                else:
+                    merged[key][1][-1] = list(merged[key][1][-1]) + list(args[-1])
+
+            for target, args, pool in merged.values():
+                thread(target, tuple(args), pool)
+        except Exception as e:
+            logger.warning(f"Delay run error: {e}", exc_info=True)
+
+
 def general_link(text: Union[int, str], link: str) -> str:
     # Get a general link
     result = ""
@@ -145,6 +201,49 @@ def general_link(text: Union[int, str], link: str) -> str:
     return result
 
 
+def get_api_wait(method: str, cid: int, low: bool) -> float:
+    # Get the secs to wait before calling the method, take the tokens if no need to wait, hold the api condition
+    result = 0.0
+
+    try:
+        now = time()
+
+        # Flood wait of the method in the chat, the low priority calls also back off after any flood wait
+        result = glovar.api_floods.get((method, cid), 0) - now
+
+        if low:
+            result = max(result, glovar.api_floods.get(("", 0), 0) - now)
+
+            # Give way to the waiting high priority calls
+            if glovar.api_waiting:
+                result = max(result, 0.1)
+
+        if result > 0:
+            return result
+
+        # Token buckets
+        keys = [("", 0)]
+        method in glovar.api_send and cid and keys.append(("send", cid))
+
+        for key in keys:
+            rate, burst = glovar.api_limits[key[0]]
+            tokens, last = glovar.api_buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            glovar.api_buckets[key] = (tokens, now)
+            result = max(result, (1 - tokens) / rate)
+
+        if result > 0:
+            return result
+
+        for key in keys:
+            tokens, last = glovar.api_buckets[key]
+            glovar.api_buckets[key] = (tokens - 1, last)
+    except Exception as e:
+        logger.warning(f"Get api wait error: {e}", exc_info=True)
+
+    return result
+
+
 def get_channel_link(message: Union[int, Message]) -> str:
     # Get a channel reference link
     text = ""
@@ -203,6 +302,41 @@ def get_command_type(message: Message) -> str:
     return result
 
 
+def get_emoji_dict(text: str) -> Dict[str, int]:
+    # Get the emojis' counts of the text, the longest emoji matches first
+    result = {}
+
+    try:
+        if not text:
+            return {}
+
+        i = 0
+
+        while i < len(text):
+            node = glovar.emoji_trie
+            end = 0
+
+            for j in range(i, len(text)):
+                node = node.get(text[j])
+
+                if node is None:
+                    break
+
+                if "" in node:
+                    end = j + 1
+
+            if end:
+                emoji = text[i:end]
+                result[emoji] = result.get(emoji, 0) + 1
+                i = end
+            else:
+                i += 1
+    except Exception as e:
+        logger.warning(f"Get emoji dict error: {e}", exc_info=True)
+
+    return result
+
+
 def get_entity_text(message: Message, entity: MessageEntity) -> str:
     # Get a message's entity text
     result = ""
@@ -212,16 +346,41 @@ def get_entity_text(message: Message, entity: MessageEntity) -> str:
         if not text or not entity:
             return ""
 
+        # Get the cached UTF-16 text
+        encoded = get_feature(message, "utf-16")
+
+        if encoded is None:
+            encoded = text.encode("utf-16-le")
+            set_feature(message, "utf-16", encoded)
+
         offset = entity.offset
         length = entity.length
-        text = text.encode("utf-16-le")
-        result = text[offset * 2:(offset + length) * 2].decode("utf-16-le")
+        result = encoded[offset * 2:(offset + length) * 2].decode("utf-16-le")
     except Exception as e:
         logger.warning(f"Get entity text error: {e}", exc_info=True)
 
     return result
 
 
+def get_feature(message: Message, name: str) -> Any:
+    # Get a cached feature of the message, return None if it is not computed yet
+    result = None
+
+    try:
+        key = (message.chat and message.chat.id, message.message_id, message.edit_date)
+
+        with glovar.locks["feature"]:
+            features = glovar.features.get(key)
+
+            if features is not None:
+                glovar.features.move_to_end(key)
+                result = features.get(name)
+    except Exception as e:
+        logger.warning(f"Get feature error: {e}", exc_info=True)
+
+    return result
+
+
 def get_filename(message: Message, normal: bool = False, printable: bool = False) -> str:
     # Get file's filename
     text = ""
@@ -299,6 +458,12 @@ def get_links(message: Message) -> List[str]:
     # Get a message's links
     result = []
     try:
+        # Get the cached links
+        links = get_feature(message, "links")
+
+        if links is not None:
+            return list(links)
+
         entities = message.entities or message.caption_entities
 
         if entities:
@@ -336,14 +501,16 @@ def get_links(message: Message) -> List[str]:
                         continue
 
                     result.append(url)
+
+        set_feature(message, "links", tuple(result))
     except Exception as e:
         logger.warning(f"Get links error: {e}", exc_info=True)
 
     return result
 
 
-def get_md5sum(the_type: str, ctx: str) -> str:
-    # Get the md5sum of a string or file
+def get_md5sum(the_type: str, ctx: Union[bytes, str]) -> str:
+    # Get the md5sum of a string, bytes or file
     result = ""
 
     try:
@@ -360,6 +527,8 @@ def get_md5sum(the_type: str, ctx: str) -> str:
             result = hash_md5.hexdigest()
         elif the_type == "string":
             result = md5(ctx.encode()).hexdigest()
+        elif the_type == "bytes":
+            result = md5(ctx).hexdigest()
     except Exception as e:
         logger.warning(f"Get md5sum error: {e}", exc_info=True)
 
@@ -377,6 +546,26 @@ def get_now() -> int:
     return result
 
 
+def get_pool_text() -> str:
+    # Get the stats text of the thread pools
+    result = ""
+
+    try:
+        with glovar.locks["pool"]:
+            stats = {pool: dict(glovar.pool_stats[pool]) for pool in glovar.pool_stats}
+
+        for pool in stats:
+            done = stats[pool]["done"] or 1
+            status = (f"pending {stats[pool]['pending']}, running {stats[pool]['running']}, "
+                      f"done {stats[pool]['done']}, wait {stats[pool]['wait'] / done:.3f}s, "
+                      f"time {stats[pool]['time'] / done:.3f}s")
+            result += f"{lang('线程池')} {pool}{lang('colon')}{code(status)}\n"
+    except Exception as e:
+        logger.warning(f"Get pool text error: {e}", exc_info=True)
+
+    return result
+
+
 def get_readable_time(secs: int = 0, the_format: str = "%Y%m%d%H%M%S") -> str:
     # Get a readable time string
     result = ""
@@ -485,6 +674,28 @@ def get_stripped_link(link: str) -> str:
     return result
 
 
+def get_t2t_table() -> Dict[int, str]:
+    # Get the translate table of the special characters, spc first and then spe
+    result = {}
+
+    try:
+        if glovar.t2t_table is not None:
+            return glovar.t2t_table
+
+        for char in set(glovar.spc_dict) | set(glovar.spe_dict):
+            value = glovar.spc_dict.get(char, char)
+            value = glovar.spe_dict.get(value, value)
+
+            if value != char:
+                result[ord(char)] = value
+
+        glovar.t2t_table = result
+    except Exception as e:
+        logger.warning(f"Get t2t table error: {e}", exc_info=True)
+
+    return result
+
+
 def get_text(message: Message, normal: bool = False, printable: bool = False) -> str:
     # Get message's text, including links and buttons
     text = ""
@@ -492,6 +703,14 @@ def get_text(message: Message, normal: bool = False, printable: bool = False) ->
         if not message:
             return ""
 
+        # Get the cached text
+        name = f"text {normal} {printable}"
+        text = get_feature(message, name)
+
+        if text is not None:
+            return text
+
+        text = ""
         the_text = message.text or message.caption
 
         if the_text:
@@ -523,6 +742,8 @@ def get_text(message: Message, normal: bool = False, printable: bool = False) ->
 
         if text:
             text = t2t(text, normal, printable)
+
+        set_feature(message, name, text)
     except Exception as e:
         logger.warning(f"Get text error: {e}", exc_info=True)
 
@@ -574,38 +795,128 @@ def random_str(i: int) -> str:
     return text
 
 
+def reset_t2t() -> bool:
+    # Rebuild the translate table at the next time, clear the cached results
+    try:
+        glovar.t2t_table = None
+        t2t_convert.cache_clear()
+
+        return True
+    except Exception as e:
+        logger.warning(f"Reset t2t error: {e}", exc_info=True)
+
+    return False
+
+
+def serial(key: Union[int, str], target: Callable, args: tuple, pool: str = "check") -> bool:
+    # Call a function in the pool, one at a time and in order for the same key
+    try:
+        with glovar.locks["serial"]:
+            queue = glovar.serials.setdefault(key, deque())
+            queue.append((target, args))
+
+            # The key is already running, its worker will run the task
+            if len(queue) > 1:
+                return True
+
+        thread(serial_run, (key,), pool)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Serial error: {e}", exc_info=True)
+
+    return False
+
+
+def serial_run(key: Union[int, str]) -> bool:
+    # Run the tasks of the key until its queue is empty
+    try:
+        while True:
+            target, args = glovar.serials[key][0]
+
+            # A failed task must not stop the key's other tasks
+            try:
+                target(*args)
+            except Exception as e:
+                logger.warning(f"Serial run {key} task error: {e}", exc_info=True)
+            finally:
+                with glovar.locks["serial"]:
+                    queue = glovar.serials[key]
+                    queue.popleft()
+
+                    empty = not queue
+                    empty and glovar.serials.pop(key, None)
+
+            if empty:
+                return True
+    except Exception as e:
+        logger.warning(f"Serial run error: {e}", exc_info=True)
+
+    return False
+
+
+def set_feature(message: Message, name: str, value: Any) -> bool:
+    # Cache a feature of the message, keep the features of the latest messages only
+    try:
+        key = (message.chat and message.chat.id, message.message_id, message.edit_date)
+
+        with glovar.locks["feature"]:
+            glovar.features.setdefault(key, {})[name] = value
+            glovar.features.move_to_end(key)
+
+            while len(glovar.features) > glovar.limit_feature:
+                glovar.features.popitem(last=False)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Set feature error: {e}", exc_info=True)
+
+    return False
+
+
 def t2t(text: str, normal: bool, printable: bool, pure: bool = False) -> str:
     # Convert the string, text to text
     try:
         if not text:
             return ""
 
-        if normal:
-            for special in ["spc", "spe"]:
-                text = "".join(eval(f"glovar.{special}_dict").get(t, t) for t in text)
+        text = t2t_convert(text, normal, printable, pure)
+    except Exception as e:
+        logger.warning(f"T2T error: {e}", exc_info=True)
+
+    return text
 
+
+@lru_cache(maxsize=4096)
+def t2t_convert(text: str, normal: bool, printable: bool, pure: bool) -> str:
+    # Convert the text, the results of the recent texts are cached
+    try:
+        if normal:
+            text = text.translate(get_t2t_table())
             text = normalize("NFKC", text)
 
-        if printable:
+        if printable and not text.isprintable():
             text = "".join(t for t in text if t.isprintable() or t in {"\n", "\r", "\t"})
 
         if normal and glovar.zh_cn:
-            text = convert(text, config="t2s.json")
+            with glovar.locks["opencc"]:
+                text = glovar.opencc.convert(text)
 
         if pure:
             text = sub(r"""[^\da-zA-Z一-龥.,:'"?!~;()。，？！～@“”]""", "", text)
     except Exception as e:
-        logger.warning(f"T2T error: {e}", exc_info=True)
+        logger.warning(f"T2T convert error: {e}", exc_info=True)
 
     return text
 
 
-def thread(target: Callable, args: tuple) -> bool:
-    # Call a function using thread
+def thread(target: Callable, args: tuple, pool: str = "api") -> bool:
+    # Call a function using the thread pool of the workload
     try:
-        t = Thread(target=target, args=args)
-        t.daemon = True
-        t.start()
+        with glovar.locks["pool"]:
+            glovar.pool_stats[pool]["pending"] += 1
+
+        glovar.pools[pool].submit(thread_run, pool, target, args, time())
 
         return True
     except Exception as e:
@@ -614,10 +925,70 @@ def thread(target: Callable, args: tuple) -> bool:
     return False
 
 
-def wait_flood(e: FloodWait) -> bool:
-    # Wait flood secs
+def thread_run(pool: str, target: Callable, args: tuple, submitted: float) -> bool:
+    # Run a function in the thread pool, record the stats
+    started = time()
+
+    with glovar.locks["pool"]:
+        glovar.pool_stats[pool]["pending"] -= 1
+        glovar.pool_stats[pool]["running"] += 1
+
+    try:
+        target(*args)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Thread run error: {e}", exc_info=True)
+    finally:
+        with glovar.locks["pool"]:
+            stats = glovar.pool_stats[pool]
+            stats["running"] -= 1
+            stats["done"] += 1
+            stats["wait"] += started - submitted
+            stats["time"] += time() - started
+
+    return False
+
+
+def wait_api(method: str, cid: int = 0) -> bool:
+    # Wait for the flood waits and the rate limits before calling the method
     try:
-        sleep(e.x + uniform(0.5, 1.0))
+        low = cid in glovar.api_low_ids
+
+        with glovar.api_condition:
+            if not low:
+                glovar.api_waiting += 1
+
+            try:
+                secs = get_api_wait(method, cid, low)
+
+                while secs > 0:
+                    glovar.api_condition.wait(secs)
+                    secs = get_api_wait(method, cid, low)
+            finally:
+                if not low:
+                    glovar.api_waiting -= 1
+                    glovar.api_condition.notify_all()
+
+        return True
+    except Exception as e:
+        logger.warning(f"Wait api error: {e}", exc_info=True)
+
+    return False
+
+
+def wait_flood(e: FloodWait, method: str = "", cid: int = 0) -> bool:
+    # Record the flood wait, the retry waits for it in wait_api, the low priority chats do not cause the back-off
+    try:
+        until = time() + e.x + uniform(0.5, 1.0)
+        keys = {(method, cid)}
+        cid not in glovar.api_low_ids and keys.add(("", 0))
+
+        with glovar.api_condition:
+            for key in keys:
+                glovar.api_floods[key] = max(glovar.api_floods.get(key, 0), until)
+
+            glovar.api_condition.notify_all()
 
         return True
     except Exception as e:
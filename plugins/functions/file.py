@@ -17,17 +17,18 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-from os import remove
-from os.path import exists
-from pickle import dump
-from shutil import copyfile
-from typing import Any
-
-from pyAesCrypt import decryptFile, encryptFile
+from io import BytesIO
+from os import remove, replace
+from os.path import exists, getsize
+from pickle import dump, dumps
+from shutil import copyfileobj
+from typing import Any, Set
+
+from pyAesCrypt import decryptFile, decryptStream, encryptFile
 from pyrogram import Client
 
 from .. import glovar
-from .etc import random_str, thread
+from .etc import random_str
 from .telegram import download_media
 
 # Enable logging
@@ -82,6 +83,23 @@ def delete_file(path: str) -> bool:
     return False
 
 
+def get_downloaded_data(client: Client, file_id: str, file_ref: str) -> bytes:
+    # Download file, read it into memory and delete it at once
+    result = b""
+    try:
+        path = get_downloaded_path(client, file_id, file_ref)
+
+        if not path:
+            return b""
+
+        result = get_file_data(path)
+        delete_file(path)
+    except Exception as e:
+        logger.warning(f"Get downloaded data error: {e}", exc_info=True)
+
+    return result
+
+
 def get_downloaded_path(client: Client, file_id: str, file_ref: str) -> str:
     # Download file, get it's path on local machine
     final_path = ""
@@ -97,6 +115,26 @@ def get_downloaded_path(client: Client, file_id: str, file_ref: str) -> str:
     return final_path
 
 
+def get_file_data(path: str, decrypt: bool = False) -> bytes:
+    # Read the file into memory, decrypt it without writing the decrypted file
+    result = b""
+    try:
+        if not path:
+            return b""
+
+        with open(path, "rb") as f:
+            if decrypt:
+                stream = BytesIO()
+                decryptStream(f, stream, glovar.password, 64 * 1024, getsize(path))
+                result = stream.getvalue()
+            else:
+                result = f.read()
+    except Exception as e:
+        logger.warning(f"Get file data error: {e}", exc_info=True)
+
+    return result
+
+
 def get_new_path(extension: str = "", prefix: str = "") -> str:
     # Get a new path in tmp directory
     result = ""
@@ -113,10 +151,39 @@ def get_new_path(extension: str = "", prefix: str = "") -> str:
     return result
 
 
-def save(file: str) -> bool:
-    # Save a global variable to a file
+def rotate_journal(file: str) -> bool:
+    # Move the journal aside before writing a new snapshot, the new changes are appended to a new journal
     try:
-        thread(save_thread, (file,))
+        path = f"data/{file}.journal"
+
+        if not exists(path):
+            return True
+
+        # The old journal is kept if the last snapshot failed
+        if not exists(f"{path}.old"):
+            replace(path, f"{path}.old")
+            return True
+
+        with open(path, "rb") as f_in, open(f"{path}.old", "ab") as f_out:
+            copyfileobj(f_in, f_out)
+
+        return delete_file(path)
+    except Exception as e:
+        logger.error(f"Rotate journal error: {e}", exc_info=True)
+
+    return False
+
+
+def save(file: str, key: Any = None) -> bool:
+    # Mark a global variable as changed, the writer will save it to a file
+    try:
+        if key is None or file not in glovar.journal_list:
+            glovar.dirty.add(file)
+            return True
+
+        # Only the entry of the key is changed
+        with glovar.locks["journal"]:
+            glovar.dirty_keys.setdefault(file, set()).add(key)
 
         return True
     except Exception as e:
@@ -125,16 +192,125 @@ def save(file: str) -> bool:
     return False
 
 
+def save_dirty() -> bool:
+    # Save the changed global variables, only one writer at a time
+    try:
+        if not glovar:
+            return True
+
+        with glovar.locks["save"]:
+            for file in sorted(set(glovar.dirty)):
+                # Changes after this point will mark it again
+                glovar.dirty.discard(file)
+
+                # The snapshot contains the changed entries
+                with glovar.locks["journal"]:
+                    glovar.dirty_keys.pop(file, None)
+
+                if not (save_table(file) if glovar.database else save_thread(file)):
+                    glovar.dirty.add(file)
+
+            for file in sorted(glovar.dirty_keys):
+                with glovar.locks["journal"]:
+                    keys = glovar.dirty_keys.pop(file, set())
+
+                if keys and not (save_rows(file, keys) if glovar.database else save_journal(file, keys)):
+                    glovar.dirty.add(file)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Save dirty error: {e}", exc_info=True)
+
+    return False
+
+
+def save_journal(file: str, keys: Set[Any]) -> bool:
+    # Append the changed entries of a global variable to its journal
+    try:
+        data = eval(f"glovar.{file}")
+        path = f"data/{file}.journal"
+
+        # A removed entry is recorded as None
+        with open(path, "ab") as f:
+            for key in keys:
+                dump((key, data.get(key)), f)
+
+        # Compact the journal into a new snapshot when it grows larger than the snapshot
+        if not exists(f"data/{file}") or getsize(path) > getsize(f"data/{file}"):
+            glovar.dirty.add(file)
+
+        return True
+    except Exception as e:
+        logger.error(f"Save journal error: {e}", exc_info=True)
+
+    return False
+
+
+def save_rows(file: str, keys: Set[Any]) -> bool:
+    # Save the changed entries of a global variable to the database
+    try:
+        data = eval(f"glovar.{file}")
+
+        with glovar.database:
+            for key in keys:
+                value = data.get(key)
+
+                if value is None:
+                    glovar.database.execute("DELETE FROM data WHERE file = ? AND key = ?", (file, dumps(key)))
+                else:
+                    glovar.database.execute("INSERT OR REPLACE INTO data VALUES (?, ?, ?)",
+                                            (file, dumps(key), dumps(value)))
+
+        return True
+    except Exception as e:
+        logger.error(f"Save rows error: {e}", exc_info=True)
+
+    return False
+
+
+def save_table(file: str) -> bool:
+    # Save a global variable to the database, a dict is saved as one row per key
+    try:
+        data = eval(f"glovar.{file}")
+
+        if isinstance(data, dict):
+            rows = [(file, b"", dumps(type(data)()))]
+            rows += [(file, dumps(key), dumps(value)) for key, value in list(data.items())]
+        else:
+            rows = [(file, b"", dumps(data))]
+
+        with glovar.database:
+            glovar.database.execute("DELETE FROM data WHERE file = ?", (file,))
+            glovar.database.executemany("INSERT INTO data VALUES (?, ?, ?)", rows)
+
+        # The journals are included in the table
+        file in glovar.journal_list and delete_file(f"data/{file}.journal")
+        file in glovar.journal_list and delete_file(f"data/{file}.journal.old")
+
+        return True
+    except Exception as e:
+        logger.error(f"Save table error: {e}", exc_info=True)
+
+    return False
+
+
 def save_thread(file: str) -> bool:
     # Save thread
     try:
         if not glovar:
             return True
 
+        # The journal must not be replayed over the new snapshot if the bot stops before it is deleted
+        if file in glovar.journal_list and not rotate_journal(file):
+            return False
+
         with open(f"data/.{file}", "wb") as f:
             dump(eval(f"glovar.{file}"), f)
 
-        copyfile(f"data/.{file}", f"data/{file}")
+        replace(f"data/.{file}", f"data/{file}")
+
+        # The old journal is included in the new snapshot
+        file in glovar.journal_list and delete_file(f"data/{file}.journal.old")
 
         return True
     except Exception as e:
@@ -18,21 +18,20 @@
 
 import logging
 import re
-from copy import deepcopy
 from string import ascii_lowercase
-from typing import Match, Optional, Union
+from typing import Any, Callable, Match, Optional, Union
 
 from pyrogram import CallbackQuery, Client, Filters, Message, User
 
 from .. import glovar
 from .channel import get_content
-from .etc import get_channel_link, get_command_type, get_entity_text, get_now, get_links, get_md5sum
-from .etc import get_stripped_link, get_text, thread
-from .file import delete_file, get_downloaded_path, save
-from .group import get_description, get_group_sticker, get_member, get_pinned
+from .etc import get_channel_link, get_command_type, get_emoji_dict, get_entity_text, get_now, get_links
+from .etc import get_feature, get_stripped_link, get_text, set_feature
+from .file import save
+from .group import get_description, get_group_sticker, get_member, get_peer, get_pinned
 from .ids import init_group_id
-from .image import get_file_id, get_qrcode
-from .telegram import resolve_username
+from .image import get_image, get_qrcode, get_qrcode_later
+from .regex import add_regex_count, get_regex_result
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -497,18 +496,13 @@ def is_emoji(the_type: str, text: str, message: Message = None) -> bool:
     # Check the emoji type
     try:
         if message:
-            text = get_text(message, False, False)
+            emoji_dict = get_feature(message, "emoji")
 
-        emoji_dict = {}
-        emoji_set = {emoji for emoji in glovar.emoji_set if emoji in text and emoji not in glovar.emoji_protect}
-        emoji_old_set = deepcopy(emoji_set)
-
-        for emoji in emoji_old_set:
-            if any(emoji in emoji_old and emoji != emoji_old for emoji_old in emoji_old_set):
-                emoji_set.discard(emoji)
-
-        for emoji in emoji_set:
-            emoji_dict[emoji] = text.count(emoji)
+            if emoji_dict is None:
+                emoji_dict = get_emoji_dict(get_text(message, False, False))
+                set_feature(message, "emoji", emoji_dict)
+        else:
+            emoji_dict = get_emoji_dict(text)
 
         # Check ad
         if the_type == "ad":
@@ -582,7 +576,7 @@ def is_friend_username(client: Client, gid: int, username: str, friend: bool, fr
         if not re.search(r"\B@([a-z][0-9a-z_]{4,31})", username, re.I | re.M | re.S):
             return False
 
-        peer_type, peer_id = resolve_username(client, username)
+        peer_type, peer_id = get_peer(client, username)
 
         if peer_type == "channel":
             if glovar.configs[gid].get("friend") or friend:
@@ -597,9 +591,9 @@ def is_friend_username(client: Client, gid: int, username: str, friend: bool, fr
                 if is_class_e_user(peer_id):
                     return True
 
-            member = get_member(client, gid, peer_id)
+            status = get_member(client, gid, peer_id)
 
-            if member and member.status in {"creator", "administrator", "member"}:
+            if status in {"creator", "administrator", "member"}:
                 return True
     except Exception as e:
         logger.warning(f"Is friend username: {e}", exc_info=True)
@@ -724,13 +718,9 @@ def is_nm_text(text: str) -> bool:
     return False
 
 
-def is_not_allowed(client: Client, message: Message, text: str = None, image_path: str = None) -> str:
-    # Check if the message is not allowed in the group
-    if image_path:
-        need_delete = [image_path]
-    else:
-        need_delete = []
-
+def is_not_allowed(client: Client, message: Message, text: str = None, image_data: bytes = None,
+                   later: Callable[[str], Any] = None) -> str:
+    # Check if the message is not allowed in the group, decode the QR code in background if later is provided
     try:
         if not message.chat:
             return ""
@@ -740,7 +730,7 @@ def is_not_allowed(client: Client, message: Message, text: str = None, image_pat
         now = message.date or get_now()
 
         # Regular message
-        if not (text or image_path):
+        if not (text or image_data):
             # Bypass
             message_content = get_content(message)
             message_text = get_text(message)
@@ -749,14 +739,11 @@ def is_not_allowed(client: Client, message: Message, text: str = None, image_pat
             if (description and message_text) and message_text in description:
                 return ""
 
-            pinned_message = get_pinned(client, gid)
-            pinned_content = get_content(pinned_message)
+            pinned_content, pinned_text = get_pinned(client, gid)
 
             if (pinned_content and message_content) and message_content in pinned_content:
                 return ""
 
-            pinned_text = get_text(pinned_message)
-
             if (pinned_text and message_text) and message_text in pinned_text:
                 return ""
 
@@ -929,24 +916,24 @@ def is_not_allowed(client: Client, message: Message, text: str = None, image_pat
 
                 # QR code
                 if is_in_config(gid, "qrc"):
-                    # Get the image
-                    file_id, file_ref, big = get_file_id(message)
-                    image_path = big and get_downloaded_path(client, file_id, file_ref)
-                    image_path and need_delete.append(image_path)
+                    # Get the image, the cached QR code skips the download and the decoding
+                    image_key, image_hash, qrcode, image_data = get_image(client, message)
 
                     # Check hash
-                    image_hash = image_path and get_md5sum("file", image_path)
-
-                    if image_path and image_hash and image_hash not in glovar.except_ids["temp"]:
+                    if image_hash and image_hash not in glovar.except_ids["temp"]:
                         # Check declare status
                         if is_declared_message(None, message):
                             return ""
 
-                        # Get QR code
-                        qrcode = get_qrcode(image_path)
+                        # Get QR code later, the message is still scheduled below
+                        if qrcode is None and later:
+                            get_qrcode_later(image_data, [image_key, image_hash], gid, later, ())
+                        else:
+                            if qrcode is None:
+                                qrcode = get_qrcode(image_data, [image_key, image_hash])
 
-                        if qrcode and not (glovar.nospam_id in glovar.admin_ids[gid] and is_ban_text(qrcode, False)):
-                            return "qrc"
+                            if is_qrcode_text(gid, qrcode):
+                                return "qrc"
 
             # Schedule to delete stickers and animations
             if (message.sticker
@@ -957,7 +944,7 @@ def is_not_allowed(client: Client, message: Message, text: str = None, image_pat
                     or message.dice):
                 mid = message.message_id
                 glovar.message_ids[gid]["stickers"][mid] = now
-                save("message_ids")
+                save("message_ids", gid)
                 return ""
 
         # Preview message
@@ -998,53 +985,48 @@ def is_not_allowed(client: Client, message: Message, text: str = None, image_pat
                         return "tgp"
 
             # QR code
-            if image_path:
-                qrcode = get_qrcode(image_path)
+            if image_data and later:
+                get_qrcode_later(image_data, [], gid, later, ())
+            elif image_data:
+                qrcode = get_qrcode(image_data)
 
-                if qrcode and not (glovar.nospam_id in glovar.admin_ids[gid] and is_ban_text(qrcode, False)):
+                if is_qrcode_text(gid, qrcode):
                     return "qrc"
     except Exception as e:
         logger.warning(f"Is not allowed error: {e}", exc_info=True)
-    finally:
-        for file in need_delete:
-            thread(delete_file, (file,))
 
     return ""
 
 
-def is_regex_text(word_type: str, text: str, ocr: bool = False, again: bool = False) -> Optional[Match]:
-    # Check if the text hit the regex rules
-    result = None
+def is_qrcode_text(gid: int, qrcode: str) -> bool:
+    # Check if the QR code is not allowed in the group
     try:
-        if text:
-            if not again:
-                text = re.sub(r"\s{2,}", " ", text)
-            elif " " in text:
-                text = re.sub(r"\s", "", text)
-            else:
-                return None
-        else:
-            return None
+        if not qrcode:
+            return False
+
+        # Let NOSPAM handle the banned text
+        if glovar.nospam_id in glovar.admin_ids[gid] and is_ban_text(qrcode, False):
+            return False
+
+        return True
+    except Exception as e:
+        logger.warning(f"Is qrcode text error: {e}", exc_info=True)
 
-        with glovar.locks["regex"]:
-            words = list(eval(f"glovar.{word_type}_words"))
+    return False
 
-        for word in words:
-            if ocr and "(?# nocr)" in word:
-                continue
 
-            result = re.search(word, text, re.I | re.S | re.M)
+def is_regex_text(word_type: str, text: str, ocr: bool = False) -> Optional[Match]:
+    # Check if the text hit the regex rules
+    result = None
+    try:
+        hit = get_regex_result(text, ocr).get(word_type)
 
-            # Count and return
-            if result:
-                count = eval(f"glovar.{word_type}_words").get(word, 0)
-                count += 1
-                eval(f"glovar.{word_type}_words")[word] = count
-                save(f"{word_type}_words")
-                return result
+        if not hit:
+            return None
 
-        # Try again
-        return is_regex_text(word_type, text, ocr, True)
+        # Count and return
+        word, result = hit
+        add_regex_count(word_type, word)
     except Exception as e:
         logger.warning(f"Is regex text error: {e}", exc_info=True)
 
@@ -1057,8 +1039,8 @@ def is_tgl(client: Client, message: Message, friend: bool = False) -> bool:
         # Bypass prepare
         gid = message.chat.id
         description = get_description(client, gid).lower()
-        pinned_message = get_pinned(client, gid)
-        pinned_text = get_text(pinned_message).lower()
+        _, pinned_text = get_pinned(client, gid)
+        pinned_text = pinned_text.lower()
 
         # Check links
         bypass = get_stripped_link(get_channel_link(message))
@@ -1134,12 +1116,12 @@ def is_tgl(client: Client, message: Message, friend: bool = False) -> bool:
 
             if en.type == "user":
                 uid = en.user.id
-                member = get_member(client, gid, uid)
+                status = get_member(client, gid, uid)
 
-                if member is False:
+                if status is False:
                     return True
 
-                if member and member.status not in {"creator", "administrator", "member"}:
+                if status and status not in {"creator", "administrator", "member"}:
                     return True
     except Exception as e:
         logger.warning(f"Is tgl error: {e}", exc_info=True)
@@ -17,28 +17,65 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-from typing import Optional
+from threading import Event
+from time import time
+from typing import Dict, List, Union
 
-from pyrogram import Chat, ChatMember, Client, Message
+from pyrogram import Client
 
 from .. import glovar
-from .etc import code, lang, t2t, thread
+from .channel import flush_evidence, get_group
+from .etc import code, lang, serial, thread
 from .file import save
 from .ids import init_group_id
-from .telegram import delete_messages, get_chat, get_chat_member, leave_chat
+from .telegram import delete_messages, get_chat_member, leave_chat, resolve_username
 
 # Enable logging
 logger = logging.getLogger(__name__)
 
 
+def delete_flush(client: Client, gid: int) -> Dict[int, bool]:
+    # Delete the buffered messages of the group, return the result of each message
+    result = {}
+    try:
+        with glovar.locks["delete"]:
+            mids: List[int] = glovar.deletions.pop(gid, [])
+
+        # Forward the evidence before the messages are gone, unless the enforcement goes first
+        not glovar.enforce and flush_evidence(client, gid, True)
+
+        for i in range(0, len(mids), 100):
+            batch = mids[i:i + 100]
+            deleted = bool(delete_messages(client, gid, batch))
+
+            for mid in batch:
+                result[mid] = deleted
+
+        # Enforcement first, the evidence is sent later from the local copies of the messages
+        glovar.enforce and flush_evidence(client, gid, False)
+
+        failed = [mid for mid in result if not result[mid]]
+        failed and logger.info(f"Delete messages {failed} in {gid} failed")
+    except Exception as e:
+        logger.warning(f"Delete flush error: {e}", exc_info=True)
+
+    return result
+
+
 def delete_message(client: Client, gid: int, mid: int) -> bool:
-    # Delete a single message
+    # Delete a single message, the messages of the group during a deletion are deleted together
     try:
         if not gid or not mid:
             return True
 
-        mids = [mid]
-        thread(delete_messages, (client, gid, mids))
+        with glovar.locks["delete"]:
+            mids = glovar.deletions.setdefault(gid, [])
+            mid not in mids and mids.append(mid)
+            first = len(mids) == 1
+
+        # Delete the first message at once, flush the group's buffer one at a time,
+        # the messages arrived during a flush are deleted together in the next flush
+        first and serial(f"delete_{gid}", delete_flush, (client, gid), "api")
 
         return True
     except Exception as e:
@@ -86,84 +123,131 @@ def get_description(client: Client, gid: int, cache: bool = True) -> str:
     # Get group's description
     result = ""
     try:
-        group = get_group(client, gid, cache)
-
-        if group and group.description:
-            result = t2t(group.description, False, False)
+        result = get_group(client, gid, cache).get("description", "")
     except Exception as e:
         logger.warning(f"Get description error: {e}", exc_info=True)
 
     return result
 
 
-def get_group(client: Client, gid: int, cache: bool = True) -> Optional[Chat]:
-    # Get the group
-    result = None
-    try:
-        the_cache = glovar.chats.get(gid)
-
-        if the_cache:
-            result = the_cache
-        else:
-            result = get_chat(client, gid)
-
-        if cache and result:
-            glovar.chats[gid] = result
-    except Exception as e:
-        logger.warning(f"Get group error: {e}", exc_info=True)
-
-    return result
-
-
 def get_group_sticker(client: Client, gid: int, cache: bool = True) -> str:
     # Get group sticker set name
     result = ""
     try:
-        group = get_group(client, gid, cache)
-
-        if group and group.sticker_set_name:
-            result = group.sticker_set_name
+        result = get_group(client, gid, cache).get("sticker", "")
     except Exception as e:
         logger.warning(f"Get group sticker error: {e}", exc_info=True)
 
     return result
 
 
-def get_member(client: Client, gid: int, uid: int, cache: bool = True) -> Optional[ChatMember]:
-    # Get a member in the group
+def get_member(client: Client, gid: int, uid: int, cache: bool = True) -> Union[bool, str, None]:
+    # Get a member's status in the group, False if the user is not a participant
     result = None
 
     try:
         if not init_group_id(gid):
             return None
 
-        the_cache = glovar.members[gid].get(uid)
+        key = (gid, uid)
+        owner = False
+
+        with glovar.locks["member"]:
+            status, fetched = glovar.members.get(key, (None, 0.0))
+            ttl = glovar.time_member if status else glovar.time_member / 10
+
+            if cache and status is not None and time() - fetched < ttl:
+                glovar.members.move_to_end(key)
+                return status
+
+            # Only one request for the member at the same time
+            event = glovar.member_events.get(key)
+
+            if event is None:
+                event = glovar.member_events[key] = Event()
+                owner = True
 
-        if cache and the_cache:
-            return the_cache
+        if not owner:
+            event.wait(60)
+            return glovar.members.get(key, (None, 0.0))[0]
 
-        result = get_chat_member(client, gid, uid)
+        try:
+            member = get_chat_member(client, gid, uid)
+            result = (member and member.status) or member
 
-        if result:
-            glovar.members[gid][uid] = result
+            if result is not None:
+                set_member(gid, uid, result)
+        finally:
+            with glovar.locks["member"]:
+                glovar.member_events.pop(key, None)
+
+            event.set()
     except Exception as e:
         logger.warning(f"Get member error: {e}", exc_info=True)
 
     return result
 
 
-def get_pinned(client: Client, gid: int, cache: bool = True) -> Optional[Message]:
-    # Get group's pinned message
-    result = None
+def get_peer(client: Client, username: str, cache: bool = True) -> (str, int):
+    # Get the peer type and id of the username, the failed usernames expire sooner
+    peer_type = ""
+    peer_id = 0
     try:
-        group = get_group(client, gid, cache)
+        username = username.strip("@")
+
+        if not username:
+            return "", 0
+
+        result = glovar.usernames.get(username)
+
+        if result and cache:
+            ttl = (result["peer_id"] and glovar.time_username) or glovar.time_username_failed
+
+            if time() - result.get("time", 0) < ttl:
+                glovar.username_stats["hit"] += 1
+                return result["peer_type"], result["peer_id"]
+
+        glovar.username_stats["miss"] += 1
+        result = resolve_username(client, username)
 
-        if group and group.pinned_message:
-            result = group.pinned_message
+        # Do not cache the temporary errors
+        if result is None:
+            return "", 0
+
+        peer_type, peer_id = result
+
+        with glovar.locks["username"]:
+            # Move the username to the end, the oldest one is removed first
+            glovar.usernames.pop(username, None)
+            glovar.usernames[username] = {
+                "peer_type": peer_type,
+                "peer_id": peer_id,
+                "time": time()
+            }
+            save("usernames", username)
+
+            while len(glovar.usernames) > glovar.limit_username:
+                oldest = next(iter(glovar.usernames))
+                glovar.usernames.pop(oldest, None)
+                save("usernames", oldest)
+    except Exception as e:
+        logger.warning(f"Get peer {username} error: {e}", exc_info=True)
+
+    return peer_type, peer_id
+
+
+def get_pinned(client: Client, gid: int, cache: bool = True) -> (str, str):
+    # Get the content and the text of group's pinned message
+    content = ""
+    text = ""
+    try:
+        group = get_group(client, gid, cache)
+        content = group.get("pinned_content", "")
+        text = group.get("pinned_text", "")
     except Exception as e:
         logger.warning(f"Get pinned error: {e}", exc_info=True)
 
-    return result
+    return content, text
 
 
 def leave_group(client: Client, gid: int) -> bool:
@@ -177,7 +261,7 @@ def leave_group(client: Client, gid: int) -> bool:
         save("admin_ids")
 
         glovar.message_ids.pop(gid, {})
-        save("message_ids")
+        save("message_ids", gid)
 
         glovar.trust_ids.pop(gid, set())
         save("trust_ids")
@@ -187,7 +271,11 @@ def leave_group(client: Client, gid: int) -> bool:
 
         glovar.declared_message_ids.pop(gid, set())
         glovar.deleted_ids.pop(gid, set())
-        glovar.members.pop(gid, {})
+
+        with glovar.locks["member"]:
+            for key in [key for key in glovar.members if key[0] == gid]:
+                glovar.members.pop(key, None)
+
         glovar.recorded_ids.pop(gid, set())
 
         return True
@@ -195,3 +283,20 @@ def leave_group(client: Client, gid: int) -> bool:
         logger.warning(f"Leave group error: {e}", exc_info=True)
 
     return False
+
+
+def set_member(gid: int, uid: int, status: Union[bool, str]) -> bool:
+    # Cache a member's status, keep the latest members only
+    try:
+        with glovar.locks["member"]:
+            glovar.members[(gid, uid)] = (status, time())
+            glovar.members.move_to_end((gid, uid))
+
+            while len(glovar.members) > glovar.limit_member:
+                glovar.members.popitem(last=False)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Set member error: {e}", exc_info=True)
+
+    return False
@@ -41,7 +41,7 @@ def init_group_id(gid: int) -> bool:
 
         if glovar.message_ids.get(gid) is None:
             glovar.message_ids[gid] = deepcopy(glovar.default_message_data)
-            save("message_ids")
+            save("message_ids", gid)
 
         if glovar.trust_ids.get(gid) is None:
             glovar.trust_ids[gid] = set()
@@ -57,9 +57,6 @@ def init_group_id(gid: int) -> bool:
         if glovar.deleted_ids.get(gid) is None:
             glovar.deleted_ids[gid] = set()
 
-        if glovar.members.get(gid) is None:
-            glovar.members[gid] = {}
-
         if glovar.recorded_ids.get(gid) is None:
             glovar.recorded_ids[gid] = set()
 
@@ -75,7 +72,7 @@ def init_user_id(uid: int) -> bool:
     try:
         if glovar.user_ids.get(uid) is None:
             glovar.user_ids[uid] = deepcopy(glovar.default_user_status)
-            save("user_ids")
+            save("user_ids", uid)
 
         return True
     except Exception as e:
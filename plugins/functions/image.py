@@ -17,14 +17,18 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
+from concurrent.futures import Future, TimeoutError
+from multiprocessing import Pipe, get_context
+from threading import Thread
+from time import time
+from typing import Any, Callable, Dict, Iterable, Optional, Union
 
-from PIL import Image, ImageEnhance
 from pyrogram import Client, Message
-from pyzbar.pyzbar import decode
 
 from .. import glovar
-from .etc import get_md5sum, t2t, thread
-from .file import delete_file, get_downloaded_path
+from .decode import decode_loop, screen_qrcode
+from .etc import get_feature, get_md5sum, serial, set_feature, t2t
+from .file import get_downloaded_data, save
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -36,15 +40,25 @@ def get_file_id(message: Message) -> (str, str, bool):
     file_ref = ""
     big = False
     try:
+        # Get the cached file id
+        cached = get_feature(message, "file_id")
+
+        if cached is not None:
+            return cached
+
+        unique_id = ""
+
         if (message.photo
                 or (message.sticker and not message.sticker.is_animated)
                 or message.document
                 or message.game):
             if message.photo:
                 file_id = message.photo.file_id
+                unique_id = getattr(message.photo, "file_unique_id", "")
                 file_ref = message.photo.file_ref
             elif message.sticker:
                 file_id = message.sticker.file_id
+                unique_id = getattr(message.sticker, "file_unique_id", "")
                 file_ref = message.sticker.file_ref
             elif message.document:
                 if (message.document.mime_type
@@ -53,9 +67,11 @@ def get_file_id(message: Message) -> (str, str, bool):
                         and message.document.file_size
                         and message.document.file_size < glovar.image_size):
                     file_id = message.document.file_id
+                    unique_id = getattr(message.document, "file_unique_id", "")
                     file_ref = message.document.file_ref
             elif message.game:
                 file_id = message.game.photo.file_id
+                unique_id = getattr(message.game.photo, "file_unique_id", "")
                 file_ref = message.game.photo.file_ref
 
         if file_id:
@@ -67,25 +83,81 @@ def get_file_id(message: Message) -> (str, str, bool):
               or (message.document and message.document.thumbs)):
             if message.animation:
                 file_id = message.animation.thumbs[-1].file_id
+                unique_id = getattr(message.animation.thumbs[-1], "file_unique_id", "")
                 file_ref = message.animation.file_ref
             elif message.audio:
                 file_id = message.audio.thumbs[-1].file_id
+                unique_id = getattr(message.audio.thumbs[-1], "file_unique_id", "")
                 file_ref = message.audio.file_ref
             elif message.video:
                 file_id = message.video.thumbs[-1].file_id
+                unique_id = getattr(message.video.thumbs[-1], "file_unique_id", "")
                 file_ref = message.video.file_ref
             elif message.video_note:
                 file_id = message.video_note.thumbs[-1].file_id
+                unique_id = getattr(message.video_note.thumbs[-1], "file_unique_id", "")
                 file_ref = message.video_note.file_ref
             elif message.document:
                 file_id = message.document.thumbs[-1].file_id
+                unique_id = getattr(message.document.thumbs[-1], "file_unique_id", "")
                 file_ref = message.document.file_ref
+
+        set_feature(message, "file_id", (file_id, file_ref, big))
+
+        # Telegram keeps the unique id of the same file, the file id is the fallback of the old API layer
+        set_feature(message, "file_unique_id", (file_id and unique_id) or file_id)
     except Exception as e:
         logger.warning(f"Get image status error: {e}", exc_info=True)
 
     return file_id, file_ref, big
 
 
+def get_file_unique_id(message: Message) -> str:
+    # Get the unique id of the image file
+    result = ""
+    try:
+        get_file_id(message)
+        result = get_feature(message, "file_unique_id") or ""
+    except Exception as e:
+        logger.warning(f"Get file unique id error: {e}", exc_info=True)
+
+    return result
+
+
+def get_image(client: Client, message: Message) -> (str, str, Optional[str], bytes):
+    # Get the unique id, the hash, the cached QR code and the downloaded data of the big image,
+    # the image is not downloaded if its QR code is cached
+    image_key = ""
+    image_hash = ""
+    qrcode = None
+    image_data = b""
+    try:
+        file_id, file_ref, big = get_file_id(message)
+
+        if not big:
+            return "", "", None, b""
+
+        image_key = get_file_unique_id(message)
+        record = get_image_record(image_key)
+
+        if record.get("qrcode") is not None:
+            return image_key, record["hash"], record["qrcode"], b""
+
+        image_data = get_downloaded_data(client, file_id, file_ref)
+        image_hash = image_data and get_md5sum("bytes", image_data)
+
+        if not image_hash:
+            return image_key, "", None, b""
+
+        # The same image may be uploaded again with another unique id
+        qrcode = get_image_record(image_hash).get("qrcode")
+        set_image_record([image_key, image_hash], image_hash, qrcode)
+    except Exception as e:
+        logger.warning(f"Get image error: {e}", exc_info=True)
+
+    return image_key, image_hash, qrcode, image_data
+
+
 def get_image_hash(client: Client, message: Message) -> str:
     # Get the image's hash
     result = ""
@@ -95,50 +167,324 @@ def get_image_hash(client: Client, message: Message) -> str:
         if not file_id:
             return ""
 
-        image_path = get_downloaded_path(client, file_id, file_ref)
+        image_key = get_file_unique_id(message)
+        result = get_image_record(image_key).get("hash", "")
+
+        if result:
+            return result
 
-        if not image_path:
+        image_data = get_downloaded_data(client, file_id, file_ref)
+
+        if not image_data:
             return ""
 
-        result = get_md5sum("file", image_path)
-        thread(delete_file, (image_path,))
+        result = get_md5sum("bytes", image_data)
+        result and set_image_record([image_key, result], result, get_image_record(result).get("qrcode"))
     except Exception as e:
         logger.warning(f"Get image hash error: {e}", exc_info=True)
 
     return result
 
 
-def get_qrcode(path: str) -> str:
-    # Get QR code
+def get_image_record(key: str) -> Dict[str, Union[float, str, None]]:
+    # Get the cached record of the image by its unique id or its hash
+    result = {}
+    try:
+        if not key:
+            return {}
+
+        with glovar.locks["image"]:
+            result = dict(glovar.images.get(key, {}))
+    except Exception as e:
+        logger.warning(f"Get image record error: {e}", exc_info=True)
+
+    return result
+
+
+def get_qrcode(data: bytes, keys: Iterable[str] = ()) -> str:
+    # Get QR code in the worker process, wait for the result, cache the result with the image's keys
     result = ""
     try:
-        if not path:
+        if not data:
             return ""
 
-        # Open
-        image = Image.open(path)
+        # Most images have no QR code, the thumbnail tells it without the full decoding,
+        # the screen may miss a QR code, so its result is not cached
+        if glovar.screen and not screen_qrcode(data):
+            return ""
+
+        future = submit_qrcode(data)
+
+        if not future:
+            return ""
+
+        result = get_qrcode_result(future)
+        result is not None and set_image_qrcode(keys, result)
+    except Exception as e:
+        logger.warning(f"Get qrcode error: {e}", exc_info=True)
+
+    return result or ""
 
-        # Gray
-        image = image.convert("L")
 
-        # Contrast
-        image = ImageEnhance.Contrast(image).enhance(4.0)
+def get_qrcode_later(data: bytes, keys: Iterable[str], key: Union[int, str], target: Callable, args: tuple) -> bool:
+    # Get QR code in the worker process, then call the target with the result after the key's other tasks
+    try:
+        if not data:
+            return False
+
+        # The image without QR code skips the worker process, the target still gets the empty result in order,
+        # the screen may miss a QR code, so its result is not cached
+        if glovar.screen and not screen_qrcode(data):
+            serial(key, target, args + ("",))
+            return True
 
-        # Thresholding
-        image = image.point(lambda x: 0 if x < 150 else 255)
+        future = submit_qrcode(data)
 
-        # Decode
-        decoded_list = decode(image)
+        if not future:
+            return False
 
-        if decoded_list:
-            for decoded in decoded_list:
-                if decoded.type == "QRCODE":
-                    result += f"{decoded.data}\n"
+        future.add_done_callback(lambda f: qrcode_done(f, keys, key, target, args))
 
-            if result:
-                result = result[:-1]
-                result = t2t(result, False, False)
+        return True
     except Exception as e:
-        logger.warning(f"Get qrcode error: {e}", exc_info=True)
+        logger.warning(f"Get qrcode later error: {e}", exc_info=True)
+
+    return False
+
+
+def get_qrcode_result(future: Future) -> Optional[str]:
+    # Wait for the decoded text of the job, the worker stops the job that runs out of time, None means failed
+    result = None
+    try:
+        result = future.result()
+        result = result and t2t(result, False, False)
+    except TimeoutError:
+        logger.warning("Get qrcode result timeout")
+    except Exception as e:
+        logger.warning(f"Get qrcode result error: {e}", exc_info=True)
+
+    return result
+
+
+def qrcode_done(future: Future, keys: Iterable[str], key: Union[int, str], target: Callable, args: tuple) -> bool:
+    # Handle the finished decoding job, it runs in the worker thread, so pass the result to other threads
+    try:
+        result = get_qrcode_result(future)
+        result is not None and set_image_qrcode(keys, result)
+        serial(key, target, args + (result or "",))
+
+        return True
+    except Exception as e:
+        logger.warning(f"Qrcode done error: {e}", exc_info=True)
+
+    return False
+
+
+def qrcode_worker() -> bool:
+    # Run the decoding jobs one at a time in the worker's own process, until the job is None
+    worker = {}
+    try:
+        while True:
+            job = glovar.qrcode_jobs.get()
+
+            if job is None:
+                break
+
+            data, future = job
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            # The job lost with a broken process runs again in a new process, the job that ran out of time does not
+            result = run_qrcode(worker, data)
+            result = run_qrcode(worker, data) if result is None else result
+
+            if result is False:
+                future.set_exception(TimeoutError())
+            elif result is None:
+                future.set_exception(RuntimeError("the worker process is broken"))
+            else:
+                future.set_result(result)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Qrcode worker error: {e}", exc_info=True)
+    finally:
+        stop_qrcode_process(worker, True)
+
+    return False
+
+
+def run_qrcode(worker: Dict[str, Any], data: bytes) -> Union[bool, str, None]:
+    # Decode the image in the worker's process, False means the job ran out of time, None means the process broke
+    result = None
+    try:
+        if not worker.get("process") or not worker["process"].is_alive():
+            stop_qrcode_process(worker, False)
+
+            if not start_qrcode_process(worker):
+                return None
+
+        conn = worker["conn"]
+        conn.send(data)
+
+        # The time of the job starts when the ready process gets it, only this process stops if it runs out of time
+        if conn.poll(glovar.time_qrcode):
+            return conn.recv()
+
+        logger.warning("Run qrcode timeout")
+        stop_qrcode_process(worker, False)
+        result = False
+    except Exception as e:
+        logger.warning(f"Run qrcode error: {e}", exc_info=True)
+        stop_qrcode_process(worker, False)
+
+    return result
+
+
+def set_image_qrcode(keys: Iterable[str], qrcode: str) -> bool:
+    # Cache the decoded QR code of the image, the empty string means no QR code
+    try:
+        keys = [key for key in keys if key]
+        image_hash = keys and get_image_record(keys[-1]).get("hash")
+
+        if not image_hash:
+            return False
+
+        return set_image_record(keys, image_hash, qrcode)
+    except Exception as e:
+        logger.warning(f"Set image qrcode error: {e}", exc_info=True)
+
+    return False
+
+
+def set_image_record(keys: Iterable[str], image_hash: str, qrcode: Optional[str]) -> bool:
+    # Cache the image's hash and QR code with the keys, the oldest records are removed first
+    try:
+        with glovar.locks["image"]:
+            for key in keys:
+                if not key:
+                    continue
+
+                glovar.images.pop(key, None)
+                glovar.images[key] = {
+                    "hash": image_hash,
+                    "qrcode": qrcode,
+                    "time": time()
+                }
+                save("images", key)
+
+            while len(glovar.images) > glovar.limit_image:
+                oldest = next(iter(glovar.images))
+                glovar.images.pop(oldest, None)
+                save("images", oldest)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Set image record error: {e}", exc_info=True)
+
+    return False
+
+
+def start_qrcode_process(worker: Dict[str, Any]) -> bool:
+    # Start the worker's process, wait until it is ready
+    try:
+        conn, child_conn = Pipe()
+        process = get_context("spawn").Process(target=decode_loop, args=(child_conn,), daemon=True)
+        process.start()
+        child_conn.close()
+        worker["process"] = process
+        worker["conn"] = conn
+
+        # Starting the process takes time, it does not count against the jobs
+        if conn.poll(60) and conn.recv():
+            return True
+
+        logger.warning("Start qrcode process timeout")
+        stop_qrcode_process(worker, False)
+    except Exception as e:
+        logger.warning(f"Start qrcode process error: {e}", exc_info=True)
+        stop_qrcode_process(worker, False)
+
+    return False
+
+
+def start_qrcode_workers() -> bool:
+    # Start the worker threads at the first job
+    try:
+        with glovar.locks["qrcode"]:
+            if glovar.qrcode_workers:
+                return True
+
+            for i in range(glovar.limit_qrcode):
+                worker = Thread(target=qrcode_worker, name=f"qrcode_{i}", daemon=True)
+                worker.start()
+                glovar.qrcode_workers.append(worker)
+
+        return True
+    except Exception as e:
+        logger.warning(f"Start qrcode workers error: {e}", exc_info=True)
+
+    return False
+
+
+def stop_qrcode_process(worker: Dict[str, Any], graceful: bool) -> bool:
+    # Stop the worker's process, let it finish if graceful, otherwise terminate it at once
+    try:
+        process = worker.pop("process", None)
+        conn = worker.pop("conn", None)
+
+        if not process:
+            return True
+
+        if graceful and process.is_alive():
+            conn.send(None)
+            process.join(glovar.time_qrcode)
+
+        process.is_alive() and process.terminate()
+        process.join()
+        conn.close()
+
+        return True
+    except Exception as e:
+        logger.warning(f"Stop qrcode process error: {e}", exc_info=True)
+
+    return False
+
+
+def stop_qrcode_workers() -> bool:
+    # Stop the worker threads after the queued jobs
+    try:
+        with glovar.locks["qrcode"]:
+            workers = glovar.qrcode_workers
+            glovar.qrcode_workers = []
+
+        for _ in workers:
+            glovar.qrcode_jobs.put(None)
+
+        for worker in workers:
+            worker.join()
+
+        return True
+    except Exception as e:
+        logger.warning(f"Stop qrcode workers error: {e}", exc_info=True)
+
+    return False
+
+
+def submit_qrcode(data: bytes) -> Optional[Future]:
+    # Submit the decoding job, wait for a free place of the bounded queue
+    result = None
+    try:
+        if not glovar.qrcode_slots.acquire(timeout=glovar.time_qrcode):
+            logger.warning("Submit qrcode timeout")
+            return None
+
+        result = Future()
+        result.add_done_callback(lambda _: glovar.qrcode_slots.release())
+        start_qrcode_workers()
+        glovar.qrcode_jobs.put((data, result))
+    except Exception as e:
+        logger.warning(f"Submit qrcode error: {e}", exc_info=True)
 
     return result
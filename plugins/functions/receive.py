@@ -19,6 +19,7 @@
 import logging
 import pickle
 from copy import deepcopy
+from io import BytesIO
 from json import loads
 from typing import Any
 
@@ -27,15 +28,16 @@ from pyrogram import Client, InlineKeyboardButton, InlineKeyboardMarkup, Message
 from .. import glovar
 from .channel import get_content, get_debug_text, share_data
 from .etc import code, crypt_str, general_link, get_int, get_now, get_report_record, get_stripped_link, get_text, lang
-from .etc import mention_id, thread
-from .file import crypt_file, data_to_file, delete_file, get_new_path, get_downloaded_path, save
+from .etc import mention_id, reset_t2t, thread
+from .file import data_to_file, delete_file, get_downloaded_path, get_file_data, save
 from .filters import is_class_e, is_declared_message_id, is_detected_user_id, is_not_allowed
 from .group import get_config_text, leave_group
 from .ids import init_group_id, init_user_id
 from .image import get_image_hash
+from .regex import compile_regex
 from .telegram import get_messages, send_message, send_report_message
 from .timers import update_admins
-from .user import terminate_user
+from .user import terminate_qrcode, terminate_user
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -164,7 +166,7 @@ def receive_captcha_kicked_user(data: dict) -> bool:
             return True
 
         glovar.user_ids[uid]["join"].pop(gid, 0)
-        save("user_ids")
+        save("user_ids", uid)
 
         result = True
     except Exception as e:
@@ -264,7 +266,7 @@ def receive_clear_data(client: Client, data_type: str, data: dict) -> bool:
                 f"{lang('admin_project')}{lang('colon')}{mention_id(aid)}\n"
                 f"{lang('action')}{lang('colon')}{code(lang('clear'))}\n"
                 f"{lang('more')}{lang('colon')}{code(f'{data_type} {the_type}')}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        thread(send_message, (client, glovar.debug_channel_id, text), "low")
     except Exception as e:
         logger.warning(f"Receive clear data: {e}", exc_info=True)
     finally:
@@ -395,21 +397,14 @@ def receive_file_data(client: Client, message: Message, decrypt: bool = True) ->
         if not path:
             return None
 
-        if decrypt:
-            # Decrypt the file, save to the tmp directory
-            path_decrypted = get_new_path()
-            crypt_file("decrypt", path, path_decrypted)
-            path_final = path_decrypted
-        else:
-            # Read the file directly
-            path_decrypted = ""
-            path_final = path
+        # Decrypt the file in memory
+        file_data = get_file_data(path, decrypt)
+        delete_file(path)
 
-        with open(path_final, "rb") as f:
-            data = pickle.load(f)
+        if not file_data:
+            return None
 
-        for f in {path, path_decrypted}:
-            thread(delete_file, (f,))
+        data = pickle.loads(file_data)
     except Exception as e:
         logger.warning(f"Receive file error: {e}", exc_info=True)
 
@@ -465,7 +460,7 @@ def receive_leave_approve(client: Client, data: dict) -> bool:
             text += f"{lang('reason')}{lang('colon')}{code(reason)}\n"
 
         leave_group(client, the_id)
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        thread(send_message, (client, glovar.debug_channel_id, text), "low")
 
         return True
     except Exception as e:
@@ -504,10 +499,11 @@ def receive_preview(client: Client, message: Message, data: dict) -> bool:
         image = preview["image"]
 
         if image:
-            image_path = get_new_path()
-            image.save(image_path, "PNG")
+            image_data = BytesIO()
+            image.save(image_data, "PNG")
+            image_data = image_data.getvalue()
         else:
-            image_path = None
+            image_data = None
 
         # Check status
         if is_declared_message_id(gid, mid) or is_detected_user_id(gid, uid, now):
@@ -520,7 +516,13 @@ def receive_preview(client: Client, message: Message, data: dict) -> bool:
             return True
 
         # Detect
-        detection = is_not_allowed(client, the_message, text, image_path)
+        detection = is_not_allowed(
+            client=client,
+            message=the_message,
+            text=text,
+            image_data=image_data,
+            later=lambda qrcode: terminate_qrcode(client, the_message, url, qrcode)
+        )
 
         if detection:
             result = terminate_user(client, the_message, detection)
@@ -550,7 +552,7 @@ def receive_refresh(client: Client, data: int) -> bool:
         text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
                 f"{lang('admin_project')}{lang('colon')}{mention_id(aid)}\n"
                 f"{lang('action')}{lang('colon')}{code(lang('refresh'))}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        thread(send_message, (client, glovar.debug_channel_id, text), "low")
 
         return True
     except Exception as e:
@@ -585,12 +587,15 @@ def receive_regex(client: Client, message: Message, data: str) -> bool:
 
         save(file_name)
 
+        # Compile the new rules
+        compile_regex(word_type)
+
         # Regenerate special characters dictionary if possible
         if file_name not in {"spc_words", "spe_words"}:
             return True
 
         special = file_name.split("_")[0]
-        exec(f"glovar.{special}_dict = {{}}")
+        special_dict = {}
 
         for rule in words_data:
             # Check keys
@@ -605,7 +610,11 @@ def receive_regex(client: Client, message: Message, data: str) -> bool:
             value = rule.split("?#")[1][1]
 
             for k in keys:
-                eval(f"glovar.{special}_dict")[k] = value
+                special_dict[k] = value
+
+        # Replace the dictionary at once, then rebuild the translate table
+        setattr(glovar, f"{special}_dict", special_dict)
+        reset_t2t()
 
         return True
     except Exception as e:
@@ -634,7 +643,7 @@ def receive_remove_bad(data: dict) -> bool:
             glovar.watch_ids["delete"].pop(the_id, {})
             save("watch_ids")
             glovar.user_ids[the_id] = deepcopy(glovar.default_user_status)
-            save("user_ids")
+            save("user_ids", the_id)
 
         save("bad_ids")
 
@@ -713,7 +722,7 @@ def receive_remove_score(data: int) -> bool:
             return True
 
         glovar.user_ids[uid] = deepcopy(glovar.default_user_status)
-        save("user_ids")
+        save("user_ids", uid)
 
         return True
     except Exception as e:
@@ -773,15 +782,19 @@ def receive_rollback(client: Client, message: Message, data: dict) -> bool:
         if not the_data:
             return True
 
-        exec(f"glovar.{the_type} = the_data")
-        save(the_type)
+        with glovar.locks["regex"]:
+            exec(f"glovar.{the_type} = the_data")
+            save(the_type)
+
+            if the_type.endswith("_words"):
+                compile_regex(the_type[:-6])
 
         # Send debug message
         text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
                 f"{lang('admin_project')}{lang('colon')}{mention_id(aid)}\n"
                 f"{lang('action')}{lang('colon')}{code(lang('rollback'))}\n"
                 f"{lang('more')}{lang('colon')}{code(the_type)}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        thread(send_message, (client, glovar.debug_channel_id, text), "low")
     except Exception as e:
         logger.warning(f"Receive rollback error: {e}", exc_info=True)
 
@@ -818,7 +831,7 @@ def receive_user_score(project: str, data: dict) -> bool:
 
         score = data["score"]
         glovar.user_ids[uid]["score"][project] = score
-        save("user_ids")
+        save("user_ids", uid)
 
         return True
     except Exception as e:
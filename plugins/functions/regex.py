@@ -0,0 +1,331 @@
+# SCP-079-CLEAN - Filter specific types of messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-CLEAN.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import logging
+import re
+import sre_parse
+from functools import lru_cache
+from typing import Dict, FrozenSet, Iterable, List, Match, Optional, Pattern, Set, Tuple, Union
+
+from .. import glovar
+from .file import save
+
+# Enable logging
+logger = logging.getLogger(__name__)
+
+
+def add_regex_count(word_type: str, word: str) -> bool:
+    # Count a hit of the rule in memory
+    try:
+        with glovar.locks["count"]:
+            counts = glovar.counts.setdefault(word_type, {})
+            counts[word] = counts.get(word, 0) + 1
+
+        return True
+    except Exception as e:
+        logger.warning(f"Add regex count error: {e}", exc_info=True)
+
+    return False
+
+
+def compile_regex(word_type: str) -> bool:
+    # Compile the rules of the word type, the caller should hold the regex lock
+    try:
+        rules = []
+
+        for word in list(getattr(glovar, f"{word_type}_words")):
+            try:
+                pattern = re.compile(word, re.I | re.S | re.M)
+                literals = get_literals(sre_parse.parse(word, re.I | re.S | re.M))
+            except Exception as e:
+                logger.warning(f"Compile regex {word_type} {word} error: {e}")
+                continue
+
+            rules.append((word, pattern, "(?# nocr)" in word, frozenset(literals or set())))
+
+        # Replace the snapshot of all types at once, the running scans keep the old one
+        compiled = dict(glovar.compiled)
+        compiled[word_type] = tuple(rules)
+        glovar.compiled = compiled
+        glovar.compiled_version += 1
+
+        return True
+    except Exception as e:
+        logger.warning(f"Compile regex {word_type} error: {e}", exc_info=True)
+
+    return False
+
+
+def get_automaton(compiled: Dict[str, tuple]) -> Dict[str, Union[dict, list, Dict[str, Tuple[int, ...]]]]:
+    # Get the Aho-Corasick automaton of all rules' literals in the snapshot of the compiled rules
+    result = {}
+
+    try:
+        the_cache = glovar.automaton
+
+        if the_cache and the_cache["compiled"] is compiled:
+            return the_cache
+
+        goto: List[Dict[str, int]] = [{}]
+        fail: List[int] = [0]
+        output: List[Set[Tuple[str, int]]] = [set()]
+        always: Dict[str, Tuple[int, ...]] = {}
+
+        # Add the literals to the trie
+        for word_type in glovar.regex:
+            rules = compiled.get(word_type, ())
+            always[word_type] = tuple(i for i, rule in enumerate(rules) if not rule[3])
+
+            for i, rule in enumerate(rules):
+                for literal in rule[3]:
+                    state = 0
+
+                    for char in literal:
+                        if char not in goto[state]:
+                            goto.append({})
+                            fail.append(0)
+                            output.append(set())
+                            goto[state][char] = len(goto) - 1
+
+                        state = goto[state][char]
+
+                    output[state].add((word_type, i))
+
+        # Link the failure states in breadth-first order
+        queue = list(goto[0].values())
+
+        for state in queue:
+            for char, next_state in goto[state].items():
+                queue.append(next_state)
+                fail_state = fail[state]
+
+                while fail_state and char not in goto[fail_state]:
+                    fail_state = fail[fail_state]
+
+                fail[next_state] = goto[fail_state].get(char, 0)
+                output[next_state] |= output[fail[next_state]]
+
+        result = {
+            "compiled": compiled,
+            "goto": goto,
+            "fail": fail,
+            "output": [frozenset(o) for o in output],
+            "always": always
+        }
+        glovar.automaton = result
+    except Exception as e:
+        logger.warning(f"Get automaton error: {e}", exc_info=True)
+
+    return result
+
+
+def get_compiled() -> Dict[str, Tuple[Tuple[str, Pattern, bool, FrozenSet[str]], ...]]:
+    # Get the snapshot of all types' compiled rules, compile the missing types
+    result = {}
+
+    try:
+        result = glovar.compiled
+
+        if all(word_type in result for word_type in glovar.regex):
+            return result
+
+        with glovar.locks["regex"]:
+            for word_type in glovar.regex:
+                word_type not in glovar.compiled and compile_regex(word_type)
+
+            result = glovar.compiled
+    except Exception as e:
+        logger.warning(f"Get compiled error: {e}", exc_info=True)
+
+    return result
+
+
+def get_literals(items: Iterable[Tuple[int, object]]) -> Optional[Set[str]]:
+    # Get the literals that one of them must appear in every match of the parsed pattern
+    result = None
+
+    try:
+        candidates = []
+        run = ""
+
+        for op, av in items:
+            if op is sre_parse.LITERAL and is_literal_char(chr(av)):
+                run += chr(av).lower()
+                continue
+
+            run and candidates.append({run})
+            run = ""
+
+            if op is sre_parse.SUBPATTERN:
+                candidate = get_literals(av[-1])
+            elif op is sre_parse.BRANCH:
+                branches = [get_literals(branch) for branch in av[1]]
+                candidate = (None if any(branch is None for branch in branches)
+                             else set().union(*branches))
+            elif op in {sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT} and av[0] >= 1:
+                candidate = get_literals(av[2])
+            else:
+                candidate = None
+
+            candidate and candidates.append(candidate)
+
+        run and candidates.append({run})
+
+        # The longest shortest literal filters best
+        if candidates:
+            result = max(candidates, key=lambda c: min(len(literal) for literal in c))
+    except Exception as e:
+        logger.warning(f"Get literals error: {e}", exc_info=True)
+
+    return result
+
+
+def get_regex_candidates(automaton: Dict[str, Union[list, Dict[str, Tuple[int, ...]]]],
+                         text: str) -> Dict[str, Set[int]]:
+    # Get the rules whose literals appear in the text
+    result = {}
+
+    try:
+        goto = automaton["goto"]
+        fail = automaton["fail"]
+        output = automaton["output"]
+        found = set()
+        state = 0
+
+        for char in text.lower():
+            while state and char not in goto[state]:
+                state = fail[state]
+
+            state = goto[state].get(char, 0)
+            output[state] and found.update(output[state])
+
+        for word_type, i in found:
+            result.setdefault(word_type, set()).add(i)
+    except Exception as e:
+        logger.warning(f"Get regex candidates error: {e}", exc_info=True)
+
+    return result
+
+
+def get_regex_hit(rules: Tuple[Tuple[str, Pattern, bool, FrozenSet[str]], ...], indexes: Iterable[int], text: str,
+                  ocr: bool) -> Optional[Tuple[str, Match]]:
+    # Get the first rule that matches the text
+    try:
+        for i in indexes:
+            word, pattern, nocr, _ = rules[i]
+
+            if ocr and nocr:
+                continue
+
+            match = pattern.search(text)
+
+            if match:
+                return word, match
+    except Exception as e:
+        logger.warning(f"Get regex hit error: {e}", exc_info=True)
+
+    return None
+
+
+def get_regex_result(text: str, ocr: bool = False) -> Dict[str, Tuple[str, Match]]:
+    # Get the first hit rule of every word type in the text
+    result = {}
+
+    try:
+        if not text:
+            return {}
+
+        result = scan_regex(text, ocr, glovar.compiled_version)
+    except Exception as e:
+        logger.warning(f"Get regex result error: {e}", exc_info=True)
+
+    return result
+
+
+def is_literal_char(char: str) -> bool:
+    # Check if the char can be found in the lower-cased text the same way the ignore-case rule finds it
+    try:
+        # Caseless chars, such as CJK characters, digits and punctuation
+        if char.lower() == char and char.upper() == char:
+            return True
+
+        # Unicode has other chars equal to i, k and s when ignoring case
+        return char.isascii() and char.lower() not in {"i", "k", "s"}
+    except Exception as e:
+        logger.warning(f"Is literal char error: {e}", exc_info=True)
+
+    return False
+
+
+def save_regex_count() -> bool:
+    # Add the counted hits to the rules' data, save the changed word types
+    try:
+        with glovar.locks["count"]:
+            counts = glovar.counts
+            glovar.counts = {}
+
+        with glovar.locks["regex"]:
+            for word_type in counts:
+                words = getattr(glovar, f"{word_type}_words")
+
+                for word, count in counts[word_type].items():
+                    if word in words:
+                        words[word] = words[word] + count
+
+                save(f"{word_type}_words")
+
+        return True
+    except Exception as e:
+        logger.warning(f"Save regex count error: {e}", exc_info=True)
+
+    return False
+
+
+@lru_cache(maxsize=1024)
+def scan_regex(text: str, ocr: bool, version: int) -> Dict[str, Tuple[str, Match]]:
+    # Scan the text with all word types once, the version makes old results unreachable
+    result = {}
+
+    try:
+        text = re.sub(r"\s{2,}", " ", text)
+
+        # Try again without spaces if the type has no hit
+        texts = [text]
+        " " in text and texts.append(re.sub(r"\s", "", text))
+
+        # Only run the rules whose literals appear, or the rules without literals,
+        # the automaton and the rules come from the same snapshot
+        compiled = get_compiled()
+        automaton = get_automaton(compiled)
+        candidates = [get_regex_candidates(automaton, the_text) for the_text in texts]
+
+        for word_type in glovar.regex:
+            rules = compiled.get(word_type, ())
+            always = automaton["always"].get(word_type, ())
+
+            for i, the_text in enumerate(texts):
+                indexes = sorted(candidates[i].get(word_type, set()).union(always))
+                hit = indexes and get_regex_hit(rules, indexes, the_text, ocr)
+
+                if hit:
+                    result[word_type] = hit
+                    break
+    except Exception as e:
+        logger.warning(f"Scan regex version {version} error: {e}", exc_info=True)
+
+    return result
@@ -17,7 +17,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import logging
-from typing import Generator, Iterable, List, Optional, Union
+from typing import Generator, Iterable, List, Optional, Tuple, Union
 
 from pyrogram import Chat, ChatMember, ChatPermissions, ChatPreview, Client, InlineKeyboardMarkup, Message
 from pyrogram.api.functions.users import GetFullUser
@@ -26,8 +26,7 @@ from pyrogram.errors import ChatAdminRequired, ButtonDataInvalid, ChannelInvalid
 from pyrogram.errors import MessageDeleteForbidden, PeerIdInvalid
 from pyrogram.errors import UsernameInvalid, UsernameNotOccupied, UserNotParticipant
 
-from .. import glovar
-from .etc import delay, get_int, t2t, wait_flood
+from .etc import delay, get_int, t2t, wait_api, wait_flood
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -46,10 +45,11 @@ def delete_messages(client: Client, cid: int, mids: Iterable[int]) -> Optional[b
                 while flood_wait:
                     flood_wait = False
                     try:
+                        wait_api("delete_messages", cid)
                         result = client.delete_messages(chat_id=cid, message_ids=mids)
                     except FloodWait as e:
                         flood_wait = True
-                        wait_flood(e)
+                        wait_flood(e, "delete_messages", cid)
             except MessageDeleteForbidden:
                 return False
             except Exception as e:
@@ -68,16 +68,37 @@ def download_media(client: Client, file_id: str, file_ref: str, file_path: str)
         while flood_wait:
             flood_wait = False
             try:
+                wait_api("download_media")
                 result = client.download_media(message=file_id, file_ref=file_ref, file_name=file_path)
             except FloodWait as e:
                 flood_wait = True
-                wait_flood(e)
+                wait_flood(e, "download_media")
     except Exception as e:
         logger.warning(f"Download media {file_id} to {file_path} error: {e}", exc_info=True)
 
     return result
 
 
+def forward_messages(client: Client, cid: int, fid: int, mids: List[int]) -> Optional[List[Message]]:
+    # Forward some messages of a chat in one request, do not wait for the flood wait, None means failed
+    result = None
+    try:
+        wait_api("forward_messages", cid)
+        result = client.forward_messages(
+            chat_id=cid,
+            from_chat_id=fid,
+            message_ids=mids,
+            disable_notification=True
+        )
+        result = list(getattr(result, "messages", result) or [])
+    except FloodWait as e:
+        wait_flood(e, "forward_messages", cid)
+    except Exception as e:
+        logger.info(f"Forward messages {mids} in {fid} to {cid} error: {e}", exc_info=True)
+
+    return result
+
+
 def get_admins(client: Client, cid: int) -> Union[bool, List[ChatMember], None]:
     # Get a group's admins
     result = None
@@ -86,10 +107,11 @@ def get_admins(client: Client, cid: int) -> Union[bool, List[ChatMember], None]:
         while flood_wait:
             flood_wait = False
             try:
+                wait_api("get_chat_members", cid)
                 result = client.get_chat_members(chat_id=cid, filter="administrators")
             except FloodWait as e:
                 flood_wait = True
-                wait_flood(e)
+                wait_flood(e, "get_chat_members", cid)
             except (PeerIdInvalid, ChannelInvalid, ChannelPrivate):
                 return False
     except Exception as e:
@@ -106,10 +128,11 @@ def get_chat(client: Client, cid: Union[int, str]) -> Union[Chat, ChatPreview, N
         while flood_wait:
             flood_wait = False
             try:
+                wait_api("get_chat", cid)
                 result = client.get_chat(chat_id=cid)
             except FloodWait as e:
                 flood_wait = True
-                wait_flood(e)
+                wait_flood(e, "get_chat", cid)
             except (PeerIdInvalid, ChannelInvalid, ChannelPrivate):
                 return None
     except Exception as e:
@@ -127,10 +150,11 @@ def get_chat_member(client: Client, cid: int, uid: int) -> Union[bool, ChatMembe
         while flood_wait:
             flood_wait = False
             try:
+                wait_api("get_chat_member", cid)
                 result = client.get_chat_member(chat_id=cid, user_id=uid)
             except FloodWait as e:
                 flood_wait = True
-                wait_flood(e)
+                wait_flood(e, "get_chat_member", cid)
             except UserNotParticipant:
                 result = False
     except Exception as e:
@@ -147,48 +171,17 @@ def get_chat_members_count(client: Client, cid: int) -> Optional[int]:
         while flood_wait:
             flood_wait = False
             try:
+                wait_api("get_chat_members_count", cid)
                 result = client.get_chat_members_count(chat_id=cid)
             except FloodWait as e:
                 flood_wait = True
-                wait_flood(e)
+                wait_flood(e, "get_chat_members_count", cid)
     except Exception as e:
         logger.warning(f"Get chat members count in {cid} error: {e}", exc_info=True)
 
     return result
 
 
-def get_group_info(client: Client, chat: Union[int, Chat], cache: bool = True) -> (str, str):
-    # Get a group's name and link
-    group_name = "Unknown Group"
-    group_link = glovar.default_group_link
-    try:
-        if isinstance(chat, int):
-            the_cache = glovar.chats.get(chat)
-
-            if the_cache:
-                chat = the_cache
-            else:
-                result = get_chat(client, chat)
-
-                if cache and result:
-                    glovar.chats[chat] = result
-
-                chat = result
-
-        if not chat:
-            return group_name, group_link
-
-        if chat.title:
-            group_name = chat.title
-
-        if chat.username:
-            group_link = "https://t.me/" + chat.username
-    except Exception as e:
-        logger.info(f"Get group {chat} info error: {e}", exc_info=True)
-
-    return group_name, group_link
-
-
 def get_members(client: Client, cid: int, query: str = "all") -> Optional[Generator[ChatMember, None, None]]:
     # Get a members generator of a chat
     result = None
@@ -198,10 +191,11 @@ def get_members(client: Client, cid: int, query: str = "all") -> Optional[Genera
         while flood_wait:
             flood_wait = False
             try:
+                wait_api("get_chat_members", cid)
                 result = client.iter_chat_members(chat_id=cid, filter=query)
             except FloodWait as e:
                 flood_wait = True
-                wait_flood(e)
+                wait_flood(e, "get_chat_members", cid)
     except Exception as e:
         logger.warning(f"Get members in {cid} error: {e}", exc_info=True)
 
@@ -216,10 +210,11 @@ def get_messages(client: Client, cid: int, mids: Union[int, Iterable[int]]) -> U
         while flood_wait:
             flood_wait = False
             try:
+                wait_api("get_messages", cid)
                 result = client.get_messages(chat_id=cid, message_ids=mids)
             except FloodWait as e:
                 flood_wait = True
-                wait_flood(e)
+                wait_flood(e, "get_messages", cid)
     except Exception as e:
         logger.warning(f"Get messages {mids} in {cid} error: {e}", exc_info=True)
 
@@ -239,13 +234,14 @@ def get_user_bio(client: Client, uid: int, normal: bool = False, printable: bool
         while flood_wait:
             flood_wait = False
             try:
+                wait_api("get_full_user")
                 user: UserFull = client.send(GetFullUser(id=user_id))
 
                 if user and user.about:
                     result = t2t(user.about, normal, printable)
             except FloodWait as e:
                 flood_wait = True
-                wait_flood(e)
+                wait_flood(e, "get_full_user")
     except Exception as e:
         logger.warning(f"Get user {uid} bio error: {e}", exc_info=True)
 
@@ -260,10 +256,11 @@ def kick_chat_member(client: Client, cid: int, uid: Union[int, str]) -> Union[bo
         while flood_wait:
             flood_wait = False
             try:
+                wait_api("kick_chat_member", cid)
                 result = client.kick_chat_member(chat_id=cid, user_id=uid)
             except FloodWait as e:
                 flood_wait = True
-                wait_flood(e)
+                wait_flood(e, "kick_chat_member", cid)
     except Exception as e:
         logger.warning(f"Kick chat member {uid} in {cid} error: {e}", exc_info=True)
 
@@ -277,10 +274,11 @@ def leave_chat(client: Client, cid: int, delete: bool = False) -> bool:
         while flood_wait:
             flood_wait = False
             try:
+                wait_api("leave_chat", cid)
                 client.leave_chat(chat_id=cid, delete=delete)
             except FloodWait as e:
                 flood_wait = True
-                wait_flood(e)
+                wait_flood(e, "leave_chat", cid)
             except (PeerIdInvalid, ChannelInvalid, ChannelPrivate):
                 return False
 
@@ -299,10 +297,11 @@ def resolve_peer(client: Client, pid: Union[int, str]) -> Union[bool, InputPeerC
         while flood_wait:
             flood_wait = False
             try:
+                wait_api("resolve_peer")
                 result = client.resolve_peer(pid)
             except FloodWait as e:
                 flood_wait = True
-                wait_flood(e)
+                wait_flood(e, "resolve_peer")
             except (PeerIdInvalid, UsernameInvalid, UsernameNotOccupied):
                 return False
     except Exception as e:
@@ -311,40 +310,30 @@ def resolve_peer(client: Client, pid: Union[int, str]) -> Union[bool, InputPeerC
     return result
 
 
-def resolve_username(client: Client, username: str, cache: bool = True) -> (str, int):
-    # Resolve peer by username
-    peer_type = ""
-    peer_id = 0
+def resolve_username(client: Client, username: str) -> Optional[Tuple[str, int]]:
+    # Resolve peer by username, return None if the request failed
+    result = None
     try:
-        username = username.strip("@")
-
-        if not username:
-            return "", 0
-
-        result = glovar.usernames.get(username)
-
-        if result and cache:
-            return result["peer_type"], result["peer_id"]
+        peer_type = ""
+        peer_id = 0
+        peer = resolve_peer(client, username)
 
-        result = resolve_peer(client, username)
+        if peer is None:
+            return None
 
-        if result:
-            if isinstance(result, InputPeerChannel):
-                peer_type = "channel"
-                peer_id = result.channel_id
-                peer_id = get_int(f"-100{peer_id}")
-            elif isinstance(result, InputPeerUser):
-                peer_type = "user"
-                peer_id = result.user_id
+        if isinstance(peer, InputPeerChannel):
+            peer_type = "channel"
+            peer_id = peer.channel_id
+            peer_id = get_int(f"-100{peer_id}")
+        elif isinstance(peer, InputPeerUser):
+            peer_type = "user"
+            peer_id = peer.user_id
 
-        glovar.usernames[username] = {
-            "peer_type": peer_type,
-            "peer_id": peer_id
-        }
+        result = peer_type, peer_id
     except Exception as e:
         logger.warning(f"Resolve username {username} error: {e}", exc_info=True)
 
-    return peer_type, peer_id
+    return result
 
 
 def restrict_chat_member(client: Client, cid: int, uid: int, permissions: ChatPermissions,
@@ -356,6 +345,7 @@ def restrict_chat_member(client: Client, cid: int, uid: int, permissions: ChatPe
         while flood_wait:
             flood_wait = False
             try:
+                wait_api("restrict_chat_member", cid)
                 result = client.restrict_chat_member(
                     chat_id=cid,
                     user_id=uid,
@@ -364,13 +354,43 @@ def restrict_chat_member(client: Client, cid: int, uid: int, permissions: ChatPe
                 )
             except FloodWait as e:
                 flood_wait = True
-                wait_flood(e)
+                wait_flood(e, "restrict_chat_member", cid)
     except Exception as e:
         logger.warning(f"Restrict chat member {uid} in {cid} error: {e}", exc_info=True)
 
     return result
 
 
+def send_cached_media(client: Client, cid: int, file_id: str, file_ref: str = None, caption: str = "",
+                      mid: int = None) -> Union[bool, Message, None]:
+    # Send a media file that already exists on the Telegram servers to a chat
+    result = None
+    try:
+        flood_wait = True
+        while flood_wait:
+            flood_wait = False
+            try:
+                wait_api("send_cached_media", cid)
+                result = client.send_cached_media(
+                    chat_id=cid,
+                    file_id=file_id,
+                    file_ref=file_ref,
+                    caption=caption,
+                    parse_mode="html",
+                    disable_notification=True,
+                    reply_to_message_id=mid
+                )
+            except FloodWait as e:
+                flood_wait = True
+                wait_flood(e, "send_cached_media", cid)
+            except (ChatAdminRequired, PeerIdInvalid, ChannelInvalid, ChannelPrivate):
+                return False
+    except Exception as e:
+        logger.warning(f"Send cached media {file_id} to {cid} error: {e}", exc_info=True)
+
+    return result
+
+
 def send_document(client: Client, cid: int, document: str, file_ref: str = None, caption: str = "", mid: int = None,
                   markup: InlineKeyboardMarkup = None) -> Union[bool, Message, None]:
     # Send a document to a chat
@@ -380,6 +400,7 @@ def send_document(client: Client, cid: int, document: str, file_ref: str = None,
         while flood_wait:
             flood_wait = False
             try:
+                wait_api("send_document", cid)
                 result = client.send_document(
                     chat_id=cid,
                     document=document,
@@ -391,7 +412,7 @@ def send_document(client: Client, cid: int, document: str, file_ref: str = None,
                 )
             except FloodWait as e:
                 flood_wait = True
-                wait_flood(e)
+                wait_flood(e, "send_document", cid)
             except ButtonDataInvalid:
                 logger.warning(f"Send document {document} to {cid} - invalid markup: {markup}")
             except (ChatAdminRequired, PeerIdInvalid, ChannelInvalid, ChannelPrivate):
@@ -414,6 +435,7 @@ def send_message(client: Client, cid: int, text: str, mid: int = None,
         while flood_wait:
             flood_wait = False
             try:
+                wait_api("send_message", cid)
                 result = client.send_message(
                     chat_id=cid,
                     text=text,
@@ -424,7 +446,7 @@ def send_message(client: Client, cid: int, text: str, mid: int = None,
                 )
             except FloodWait as e:
                 flood_wait = True
-                wait_flood(e)
+                wait_flood(e, "send_message", cid)
             except ButtonDataInvalid:
                 logger.warning(f"Send message to {cid} - invalid markup: {markup}")
             except (ChatAdminRequired, PeerIdInvalid, ChannelInvalid, ChannelPrivate):
@@ -447,6 +469,7 @@ def send_report_message(secs: int, client: Client, cid: int, text: str, mid: int
         while flood_wait:
             flood_wait = False
             try:
+                wait_api("send_message", cid)
                 result = client.send_message(
                     chat_id=cid,
                     text=text,
@@ -457,7 +480,7 @@ def send_report_message(secs: int, client: Client, cid: int, text: str, mid: int
                 )
             except FloodWait as e:
                 flood_wait = True
-                wait_flood(e)
+                wait_flood(e, "send_message", cid)
             except ButtonDataInvalid:
                 logger.warning(f"Send report message to {cid} - invalid markup: {markup}")
 
@@ -466,7 +489,7 @@ def send_report_message(secs: int, client: Client, cid: int, text: str, mid: int
 
         mid = result.message_id
         mids = [mid]
-        delay(secs, delete_messages, [client, cid, mids])
+        delay(secs, delete_messages, [client, cid, mids], ("delete", cid))
     except Exception as e:
         logger.warning(f"Send report message to {cid} error: {e}", exc_info=True)
 
@@ -481,10 +504,11 @@ def unban_chat_member(client: Client, cid: int, uid: Union[int, str]) -> Optiona
         while flood_wait:
             flood_wait = False
             try:
+                wait_api("unban_chat_member", cid)
                 result = client.unban_chat_member(chat_id=cid, user_id=uid)
             except FloodWait as e:
                 flood_wait = True
-                wait_flood(e)
+                wait_flood(e, "unban_chat_member", cid)
     except Exception as e:
         logger.warning(f"Unban chat member {uid} in {cid} error: {e}", exc_info=True)
 
@@ -18,16 +18,14 @@
 
 import logging
 import re
-from copy import deepcopy
 
 from pyrogram import Client, Message
 
 from .. import glovar
 from .channel import get_content
-from .etc import code, get_int, get_md5sum, get_text, lang, mention_id, thread
-from .file import delete_file, get_downloaded_path
+from .etc import code, get_emoji_dict, get_int, get_text, lang, mention_id, thread
 from .filters import is_bmd, is_class_e, is_detected_url, is_emoji, is_exe, is_regex_text, is_tgl
-from .image import get_file_id, get_qrcode
+from .image import get_image, get_qrcode
 from .telegram import send_message
 
 # Enable logging
@@ -98,28 +96,15 @@ def clean_test(client: Client, message: Message) -> bool:
             text += f"{lang('tgp')}{lang('colon')}{code('True')}\n"
 
         # QR code
-        file_id, file_ref, big = get_file_id(message)
-        image_path = big and get_downloaded_path(client, file_id, file_ref)
-        image_hash = image_path and get_md5sum("file", image_path)
-        qrcode = image_path and get_qrcode(image_path)
-        image_path and thread(delete_file, (image_path,))
+        image_key, image_hash, qrcode, image_data = get_image(client, message)
+        qrcode = qrcode if qrcode is not None else image_data and get_qrcode(image_data, [image_key, image_hash])
 
         if qrcode:
             text += f"{lang('qrc')}{lang('colon')}{code('True')}\n"
 
         # Show emoji
         emoji_text = get_text(message, False, False)
-        emoji_dict = {}
-        emoji_set = {emoji for emoji in glovar.emoji_set
-                     if emoji in emoji_text and emoji not in glovar.emoji_protect}
-        emoji_old_set = deepcopy(emoji_set)
-
-        for emoji in emoji_old_set:
-            if any(emoji in emoji_old and emoji != emoji_old for emoji_old in emoji_old_set):
-                emoji_set.discard(emoji)
-
-        for emoji in emoji_set:
-            emoji_dict[emoji] = emoji_text.count(emoji)
+        emoji_dict = get_emoji_dict(emoji_text)
 
         if emoji_dict:
             text += f"{lang('emoji_total')}{lang('colon')}{code(sum(emoji_dict.values()))}\n\n"
@@ -24,12 +24,13 @@ from pyrogram import Client
 from pyrogram.errors import FloodWait
 
 from .. import glovar
-from .channel import get_debug_text, share_data, share_regex_count
+from .channel import get_debug_text, get_group_info, share_data, share_regex_count
 from .etc import code, general_link, get_now, lang, thread, wait_flood
-from .file import save
+from .file import data_to_file, save, save_dirty
 from .filters import is_in_config
 from .group import leave_group
-from .telegram import delete_messages, get_admins, get_chat_members_count, get_group_info, get_members, send_message
+from .regex import save_regex_count
+from .telegram import delete_messages, get_admins, get_chat_members_count, get_members, send_message
 from .user import kick_user, unban_user
 
 # Enable logging
@@ -39,6 +40,12 @@ logger = logging.getLogger(__name__)
 def backup_files(client: Client) -> bool:
     # Backup data files to BACKUP
     try:
+        # Save the changed files first, fold the journals into the snapshots
+        for file in glovar.journal_list:
+            save(file)
+
+        save_dirty()
+
         for file in glovar.file_list:
             # Check
             if not eval(f"glovar.{file}"):
@@ -51,7 +58,7 @@ def backup_files(client: Client) -> bool:
                 action="backup",
                 action_type="data",
                 data=file,
-                file=f"data/{file}"
+                file=(glovar.database and data_to_file(eval(f"glovar.{file}"))) or f"data/{file}"
             )
             sleep(5)
 
@@ -94,7 +101,7 @@ def clean_banned(client: Client) -> bool:
                     text += (f"{lang('action')}{lang('colon')}{code(lang('clean_blacklist'))}\n"
                              f"{lang('rule')}{lang('colon')}{code(lang('rule_custom'))}\n"
                              f"{lang('invalid_user')}{lang('colon')}{code(count_text)}\n")
-                    thread(send_message, (client, glovar.debug_channel_id, text))
+                    thread(send_message, (client, glovar.debug_channel_id, text), "low")
                 except FloodWait as e:
                     flood_wait = True
                     wait_flood(e)
@@ -145,7 +152,7 @@ def clean_members(client: Client) -> bool:
                     text += (f"{lang('action')}{lang('colon')}{code(lang('clean_members'))}\n"
                              f"{lang('rule')}{lang('colon')}{code(lang('rule_custom'))}\n"
                              f"{lang('invalid_user')}{lang('colon')}{code(count_text)}\n")
-                    thread(send_message, (client, glovar.debug_channel_id, text))
+                    thread(send_message, (client, glovar.debug_channel_id, text), "low")
                 except FloodWait as e:
                     flood_wait = True
                     wait_flood(e)
@@ -196,7 +203,7 @@ def interval_hour_01(client: Client) -> bool:
                 text += (f"{lang('action')}{lang('colon')}{code(lang('schedule_delete'))}\n"
                          f"{lang('rule')}{lang('colon')}{code(lang('rule_custom'))}\n"
                          f"{lang('sticker')}{lang('colon')}{code(count_text)}\n")
-                thread(send_message, (client, glovar.debug_channel_id, text))
+                thread(send_message, (client, glovar.debug_channel_id, text), "low")
 
         save("message_ids")
     except Exception as e:
@@ -205,6 +212,19 @@ def interval_hour_01(client: Client) -> bool:
     return False
 
 
+def interval_min_01() -> bool:
+    # Execute every minute
+    try:
+        # Save regex count
+        save_regex_count()
+
+        return True
+    except Exception as e:
+        logger.warning(f"Interval min 01 error: {e}", exc_info=True)
+
+    return False
+
+
 def interval_min_10() -> bool:
     # Execute every 10 minutes
     glovar.locks["message"].acquire()
@@ -254,7 +274,7 @@ def reset_data(client: Client) -> bool:
         # Send debug message
         text = (f"{lang('project')}{lang('colon')}{general_link(glovar.project_name, glovar.project_link)}\n"
                 f"{lang('action')}{lang('colon')}{code(lang('reset'))}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        thread(send_message, (client, glovar.debug_channel_id, text), "low")
 
         return True
     except Exception as e:
@@ -267,6 +287,8 @@ def reset_data(client: Client) -> bool:
 
 def send_count(client: Client) -> bool:
     # Send regex count to REGEX
+    save_regex_count()
+
     glovar.locks["regex"].acquire()
     try:
         for word_type in glovar.regex:
@@ -345,7 +367,7 @@ def update_admins(client: Client) -> bool:
                               f"{lang('group_name')}{lang('colon')}{general_link(group_name, group_link)}\n"
                               f"{lang('group_id')}{lang('colon')}{code(gid)}\n"
                               f"{lang('status')}{lang('colon')}{code(reason)}\n")
-                thread(send_message, (client, glovar.debug_channel_id, debug_text))
+                thread(send_message, (client, glovar.debug_channel_id, debug_text), "low")
             elif admin_members is False or any([admin.user.is_self for admin in admin_members]) is False:
                 # Bot is not in the chat, leave automatically without approve
                 group_name, group_link = get_group_info(client, gid)
@@ -367,7 +389,7 @@ def update_admins(client: Client) -> bool:
                               f"{lang('group_id')}{lang('colon')}{code(gid)}\n"
                               f"{lang('status')}{lang('colon')}{code(lang('leave_auto'))}\n"
                               f"{lang('reason')}{lang('colon')}{code(lang('reason_leave'))}\n")
-                thread(send_message, (client, glovar.debug_channel_id, debug_text))
+                thread(send_message, (client, glovar.debug_channel_id, debug_text), "low")
 
         return True
     except Exception as e:
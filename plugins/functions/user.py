@@ -24,12 +24,12 @@ from pyrogram import ChatPermissions, Client, Message
 
 from .. import glovar
 from .etc import crypt_str, get_forward_name, get_full_name, get_now, lang, thread
-from .channel import ask_for_help, declare_message, forward_evidence, send_debug, share_bad_user
+from .channel import ask_for_help, declare_message, queue_evidence, share_bad_user
 from .channel import share_watch_user, update_score
 from .file import save
 from .group import delete_message
 from .filters import is_class_d, is_class_e_user, is_declared_message, is_detected_user, is_high_score_user
-from .filters import is_limited_user, is_new_user, is_watch_user, is_wb_text
+from .filters import is_limited_user, is_new_user, is_qrcode_text, is_watch_user, is_wb_text
 from .ids import init_user_id
 from .telegram import kick_chat_member, restrict_chat_member, unban_chat_member
 
@@ -62,6 +62,7 @@ def add_detected_user(gid: int, uid: int, now: int) -> bool:
 
         previous = glovar.user_ids[uid]["detected"].get(gid)
         glovar.user_ids[uid]["detected"][gid] = now
+        save("user_ids", uid)
 
         return bool(previous)
     except Exception as e:
@@ -128,6 +129,29 @@ def kick_user_thread(client: Client, gid: int, uid: Union[int, str]) -> bool:
     return False
 
 
+def terminate_qrcode(client: Client, message: Message, content: str, qrcode: str) -> bool:
+    # Terminate the user if the decoded QR code is not allowed
+    try:
+        if not is_qrcode_text(message.chat.id, qrcode):
+            return False
+
+        result = terminate_user(client, message, "qrc")
+
+        if not result or not content:
+            return result
+
+        # The content may be excepted while decoding
+        glovar.contents[content] = "qrc"
+        glovar.except_ids["temp"].discard(content)
+        save("except_ids")
+
+        return True
+    except Exception as e:
+        logger.warning(f"Terminate qrcode error: {e}", exc_info=True)
+
+    return False
+
+
 def terminate_user(client: Client, message: Message, the_type: str) -> bool:
     # Terminate the user
     try:
@@ -150,12 +174,12 @@ def terminate_user(client: Client, message: Message, the_type: str) -> bool:
                     and (full_name not in glovar.except_ids["long"] and forward_name not in glovar.except_ids["long"])
                     and not is_class_e_user(message.from_user)
                     and uid not in glovar.white_ids):
-                result = forward_evidence(
-                    client=client,
+                result = queue_evidence(
                     message=message,
                     level=lang("auto_ban"),
                     rule=lang("name_examine"),
-                    the_type=the_type
+                    the_type=the_type,
+                    action=lang("name_ban")
                 )
 
                 if result:
@@ -164,21 +188,13 @@ def terminate_user(client: Client, message: Message, the_type: str) -> bool:
                     delete_message(client, gid, mid)
                     declare_message(client, gid, mid)
                     ask_for_help(client, "ban", gid, uid)
-                    send_debug(
-                        client=client,
-                        chat=message.chat,
-                        action=lang("name_ban"),
-                        uid=uid,
-                        mid=mid,
-                        em=result
-                    )
             elif is_watch_user(message.from_user, "ban", now) and uid not in glovar.white_ids:
-                result = forward_evidence(
-                    client=client,
+                result = queue_evidence(
                     message=message,
                     level=lang("auto_ban"),
                     rule=lang("watch_user"),
-                    the_type=the_type
+                    the_type=the_type,
+                    action=lang("watch_ban")
                 )
 
                 if result:
@@ -187,22 +203,14 @@ def terminate_user(client: Client, message: Message, the_type: str) -> bool:
                     delete_message(client, gid, mid)
                     declare_message(client, gid, mid)
                     ask_for_help(client, "ban", gid, uid)
-                    send_debug(
-                        client=client,
-                        chat=message.chat,
-                        action=lang("watch_ban"),
-                        uid=uid,
-                        mid=mid,
-                        em=result
-                    )
             elif is_high_score_user(message.from_user):
                 score = is_high_score_user(message.from_user)
-                result = forward_evidence(
-                    client=client,
+                result = queue_evidence(
                     message=message,
                     level=lang("auto_ban"),
                     rule=lang("score_user"),
                     the_type=the_type,
+                    action=lang("score_ban"),
                     score=score
                 )
 
@@ -212,23 +220,15 @@ def terminate_user(client: Client, message: Message, the_type: str) -> bool:
                     delete_message(client, gid, mid)
                     declare_message(client, gid, mid)
                     ask_for_help(client, "ban", gid, uid)
-                    send_debug(
-                        client=client,
-                        chat=message.chat,
-                        action=lang("score_ban"),
-                        uid=uid,
-                        mid=mid,
-                        em=result
-                    )
             elif (is_watch_user(message.from_user, "delete", now)
                   and uid not in glovar.white_ids
                   and the_type in {"aff", "exe", "iml", "pho", "tgp", "qrc"}):
-                result = forward_evidence(
-                    client=client,
+                result = queue_evidence(
                     message=message,
                     level=lang("global_delete"),
                     rule=lang("watch_user"),
-                    the_type=the_type
+                    the_type=the_type,
+                    action=lang("watch_delete")
                 )
 
                 if result:
@@ -238,24 +238,16 @@ def terminate_user(client: Client, message: Message, the_type: str) -> bool:
                     ask_for_help(client, "delete", gid, uid, "global")
                     previous = add_detected_user(gid, uid, now)
                     not previous and update_score(client, uid)
-                    send_debug(
-                        client=client,
-                        chat=message.chat,
-                        action=lang("watch_delete"),
-                        uid=uid,
-                        mid=mid,
-                        em=result
-                    )
             elif (((is_new_user(message.from_user, now, 0, True) and the_type in {"exe", "qrc"})
                    or (is_new_user(message.from_user, now, gid) and the_type in {"aff", "sho", "tgp"})
                    or (is_limited_user(gid, message.from_user, now) and the_type in {"iml", "pho", "tgl"}))
                   and uid not in glovar.white_ids):
-                result = forward_evidence(
-                    client=client,
+                result = queue_evidence(
                     message=message,
                     level=lang("global_delete"),
                     rule=lang("op_upgrade"),
-                    the_type=the_type
+                    the_type=the_type,
+                    action=lang("global_delete")
                 )
 
                 if result:
@@ -265,25 +257,17 @@ def terminate_user(client: Client, message: Message, the_type: str) -> bool:
                     ask_for_help(client, "delete", gid, uid, "global")
                     previous = add_detected_user(gid, uid, now)
                     not previous and update_score(client, uid)
-                    send_debug(
-                        client=client,
-                        chat=message.chat,
-                        action=lang("global_delete"),
-                        uid=uid,
-                        mid=mid,
-                        em=result
-                    )
             elif is_detected_user(message) or uid in glovar.recorded_ids[gid] or the_type == "true":
                 delete_message(client, gid, mid)
                 add_detected_user(gid, uid, now)
                 declare_message(client, gid, mid)
             else:
-                result = forward_evidence(
-                    client=client,
+                result = queue_evidence(
                     message=message,
                     level=lang("auto_delete"),
                     rule=lang("rule_custom"),
                     the_type=the_type,
+                    action=lang("auto_delete"),
                     general=False
                 )
 
@@ -293,25 +277,17 @@ def terminate_user(client: Client, message: Message, the_type: str) -> bool:
                     declare_message(client, gid, mid)
                     previous = add_detected_user(gid, uid, now)
                     not previous and update_score(client, uid)
-                    send_debug(
-                        client=client,
-                        chat=message.chat,
-                        action=lang("auto_delete"),
-                        uid=uid,
-                        mid=mid,
-                        em=result
-                    )
         else:
             if uid in glovar.recorded_ids[gid]:
                 delete_message(client, gid, mid)
                 declare_message(client, gid, mid)
             else:
-                result = forward_evidence(
-                    client=client,
+                result = queue_evidence(
                     message=message,
                     level=lang("auto_delete"),
                     rule=lang("rule_custom"),
                     the_type=the_type,
+                    action=lang("auto_delete"),
                     general=False
                 )
 
@@ -319,16 +295,6 @@ def terminate_user(client: Client, message: Message, the_type: str) -> bool:
                     glovar.recorded_ids[gid].add(uid)
                     delete_message(client, gid, mid)
                     declare_message(client, gid, mid)
-                    the_type = (lambda x: x if x in glovar.types["basic"] else None)(the_type)
-                    send_debug(
-                        client=client,
-                        chat=message.chat,
-                        action=lang("auto_delete"),
-                        uid=uid,
-                        mid=mid,
-                        em=result,
-                        the_type=the_type
-                    )
 
         return bool(result)
     except Exception as e:
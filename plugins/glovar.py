@@ -18,17 +18,22 @@
 
 import logging
 import pickle
+import sqlite3
 from codecs import getdecoder
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from configparser import RawConfigParser
-from os import mkdir
-from os.path import exists
+from itertools import count
+from os import mkdir, remove
+from os.path import exists, getmtime
+from queue import Queue
 from shutil import rmtree
 from string import ascii_lowercase
-from threading import Lock
-from typing import Dict, List, Set, Tuple, Union
+from threading import BoundedSemaphore, Condition, Event, Lock, Thread
+from typing import Any, Callable, Deque, Dict, FrozenSet, Hashable, Iterator, List, Optional, Pattern, Set, Tuple, Union
 
 from emoji import UNICODE_EMOJI
-from pyrogram import Chat, ChatMember
+from opencc import OpenCC
 
 # Enable logging
 logging.basicConfig(
@@ -73,17 +78,33 @@ aio: Union[bool, str] = ""
 backup: Union[bool, str] = ""
 date_reset: str = ""
 default_group_link: str = ""
+enforce: Union[bool, str] = ""
 image_size: int = 0
 invalid: Union[str, Set[str]] = ""
+limit_check: int = 0
+limit_feature: int = 0
+limit_image: int = 0
+limit_member: int = 0
+limit_qrcode: int = 0
 limit_track: int = 0
+limit_username: int = 0
 project_link: str = ""
 project_name: str = ""
+screen: Union[bool, str] = ""
+storage: str = ""
 time_ban: int = 0
+time_digest: int = 0
+time_group: int = 0
+time_member: int = 0
 time_new: int = 0
 time_punish: int = 0
+time_qrcode: int = 0
+time_save: int = 0
 time_short: int = 0
 time_sticker: int = 0
 time_track: int = 0
+time_username: int = 0
+time_username_failed: int = 0
 zh_cn: Union[bool, str] = ""
 
 # [emoji]
@@ -135,19 +156,37 @@ try:
     backup = eval(backup)
     date_reset = config["custom"].get("date_reset", date_reset)
     default_group_link = config["custom"].get("default_group_link", default_group_link)
+    enforce = config["custom"].get("enforce", "True")
+    enforce = eval(enforce)
     image_size = int(config["custom"].get("image_size", str(image_size)))
     invalid = config["custom"].get("invalid", invalid)
     invalid = set(invalid.split())
     invalid = {i.lower() for i in invalid}
+    limit_check = int(config["custom"].get("limit_check", "8"))
+    limit_feature = int(config["custom"].get("limit_feature", "1024"))
+    limit_image = int(config["custom"].get("limit_image", "20000"))
+    limit_member = int(config["custom"].get("limit_member", "20000"))
+    limit_qrcode = int(config["custom"].get("limit_qrcode", "2"))
     limit_track = int(config["custom"].get("limit_track", str(limit_track)))
+    limit_username = int(config["custom"].get("limit_username", "20000"))
     project_link = config["custom"].get("project_link", project_link)
     project_name = config["custom"].get("project_name", project_name)
+    screen = config["custom"].get("screen", "True")
+    screen = eval(screen)
+    storage = config["custom"].get("storage", "pickle")
     time_ban = int(config["custom"].get("time_ban", str(time_ban)))
+    time_digest = int(config["custom"].get("time_digest", "5"))
+    time_group = int(config["custom"].get("time_group", "3600"))
+    time_member = int(config["custom"].get("time_member", "3600"))
     time_new = int(config["custom"].get("time_new", str(time_new)))
     time_punish = int(config["custom"].get("time_punish", str(time_punish)))
+    time_qrcode = int(config["custom"].get("time_qrcode", "10"))
+    time_save = int(config["custom"].get("time_save", "10"))
     time_short = int(config["custom"].get("time_short", str(time_short)))
     time_sticker = int(config["custom"].get("time_sticker", str(time_sticker)))
     time_track = int(config["custom"].get("time_track", str(time_track)))
+    time_username = int(config["custom"].get("time_username", "604800"))
+    time_username_failed = int(config["custom"].get("time_username_failed", "3600"))
     zh_cn = config["custom"].get("zh_cn", zh_cn)
     zh_cn = eval(zh_cn)
 
@@ -191,17 +230,33 @@ if (bot_token in {"", "[DATA EXPUNGED]"}
         or backup not in {False, True}
         or date_reset in {"", "[DATA EXPUNGED]"}
         or default_group_link in {"", "[DATA EXPUNGED]"}
+        or enforce not in {False, True}
         or image_size == 0
         or invalid in {"", "[DATA EXPUNGED]"} or invalid == set()
+        or limit_check == 0
+        or limit_feature == 0
+        or limit_image == 0
+        or limit_member == 0
+        or limit_qrcode == 0
         or limit_track == 0
+        or limit_username == 0
         or project_link in {"", "[DATA EXPUNGED]"}
         or project_name in {"", "[DATA EXPUNGED]"}
+        or screen not in {False, True}
+        or storage not in {"pickle", "sqlite"}
         or time_ban == 0
+        or time_digest == 0
+        or time_group == 0
+        or time_member == 0
         or time_new == 0
         or time_punish == 0
+        or time_qrcode == 0
+        or time_save == 0
         or time_short == 0
         or time_sticker == 0
         or time_track == 0
+        or time_username == 0
+        or time_username_failed == 0
         or zh_cn not in {False, True}
         or emoji_ad_single == 0
         or emoji_ad_total == 0
@@ -214,6 +269,32 @@ if (bot_token in {"", "[DATA EXPUNGED]"}
     logger.critical("No proper settings")
     raise SystemExit("No proper settings")
 
+# Init api variables
+api_buckets: Dict[Tuple[str, int], Tuple[float, float]] = {}
+# api_buckets = {
+#     ("send", -10012345678): (19.0, 1512345678.0)
+# }
+
+api_condition: Condition = Condition()
+
+api_floods: Dict[Tuple[str, int], float] = {}
+# api_floods = {
+#     ("send_message", -10012345678): 1512345678.0
+# }
+
+# Tokens per second and the bucket size
+api_limits: Dict[str, Tuple[float, float]] = {
+    "": (30.0, 30.0),
+    "send": (20 / 60, 20.0)
+}
+
+# Calls to these chats have low priority
+api_low_ids: Set[int] = {debug_channel_id, logging_channel_id}
+
+api_send: Set[str] = {"forward_messages", "send_cached_media", "send_document", "send_message"}
+
+api_waiting: int = 0
+
 # Languages
 lang: Dict[str, str] = {
     # Admin
@@ -391,17 +472,37 @@ all_commands: List[str] = [
     "version"
 ]
 
+automaton: Dict[str, Union[dict, list, Dict[str, Tuple[int, ...]]]] = {}
+# automaton = {
+#     "compiled": compiled,
+#     "goto": [{"t": 1}],
+#     "fail": [0],
+#     "output": [frozenset()],
+#     "always": {
+#         "tgl": (0,)
+#     }
+# }
+
 bot_ids: Set[int] = {avatar_id, captcha_id, clean_id, lang_id, long_id, noflood_id,
                      noporn_id, nospam_id, tip_id, user_id, warn_id}
 
-chats: Dict[int, Chat] = {}
-# chats = {
-#     -10012345678: Chat
-# }
-
 cleaned_ids: Set[int] = set()
 # cleaned_ids = {-10012345678}
 
+compiled: Dict[str, Tuple[Tuple[str, Pattern, bool, FrozenSet[str]], ...]] = {}
+# compiled = {
+#     "tgl": (("regex", Pattern, False, frozenset({"t.me"})),)
+# }
+
+compiled_version: int = 0
+
+counts: Dict[str, Dict[str, int]] = {}
+# counts = {
+#     "tgl": {
+#         "regex": 1
+#     }
+# }
+
 contents: Dict[str, str] = {}
 # contents = {
 #     "content": "tgl"
@@ -417,6 +518,11 @@ deleted_ids: Dict[int, Set[int]] = {}
 #     -10012345678: {12345678}
 # }
 
+deletions: Dict[int, List[int]] = {}
+# deletions = {
+#     -10012345678: [123, 124]
+# }
+
 default_config: Dict[str, Union[bool, int]] = {
     "default": True,
     "lock": 0,
@@ -476,25 +582,126 @@ default_user_status: Dict[str, Dict[Union[int, str], Union[float, int]]] = {
     }
 }
 
+delay_condition: Condition = Condition()
+
+delay_ids: Iterator[int] = count(1)
+
+delay_tasks: Dict[int, Tuple[Callable, list, Optional[Hashable], str]] = {}
+# delay_tasks = {
+#     1: (delete_messages, [client, -10012345678, [123]], ("delete", -10012345678), "api")
+# }
+
+delay_thread: Optional[Thread] = None
+
+delays: List[Tuple[int, int]] = []
+# delays = [(1512345678, 1)]
+
+digests: Dict[int, List[str]] = {}
+# digests = {
+#     -10012345678: ["debug notice text"]
+# }
+
+dirty: Set[str] = set()
+# dirty = {"user_ids"}
+
+dirty_keys: Dict[str, Set[int]] = {}
+# dirty_keys = {
+#     "user_ids": {12345678}
+# }
+
 emoji_set: Set[str] = set(UNICODE_EMOJI)
 
+evidences: Dict[int, List[Tuple[int, Any, str, Tuple[int, str, int, str]]]] = {}
+# evidences = {
+#     -10012345678: [(-10012345679, message, "report text", (12345678, "action", 123, "tgl"))]
+# }
+
+group_locks: Dict[int, Lock] = {}
+# group_locks = {
+#     -10012345678: Lock()
+# }
+
+groups: Dict[int, Dict[str, Union[float, str]]] = {}
+# groups = {
+#     -10012345678: {
+#         "time": 1512345678.0,
+#         "name": "Group Name",
+#         "link": "https://t.me/example",
+#         "description": "description",
+#         "pinned_content": "content",
+#         "pinned_text": "text",
+#         "sticker": "sticker_set_name"
+#     }
+# }
+
+features: Dict[Tuple[int, int, int], Dict[str, Any]] = OrderedDict()
+# features = {
+#     (-10012345678, 123, None): {
+#         "text False False": "text",
+#         "content": "content"
+#     }
+# }
+
+# Build the emoji trie, the empty key marks the end of an emoji
+emoji_trie: Dict[str, dict] = {}
+
+for emoji in emoji_set:
+    if emoji in emoji_protect:
+        continue
+
+    node = emoji_trie
+
+    for char in emoji:
+        node = node.setdefault(char, {})
+
+    node[""] = emoji
+
+# emoji_trie = {
+#     "\U0001F44D": {
+#         "": "\U0001F44D",
+#         "\U0001F3FB": {
+#             "": "\U0001F44D\U0001F3FB"
+#         }
+#     }
+# }
+
+
 locks: Dict[str, Lock] = {
     "admin": Lock(),
     "config": Lock(),
+    "count": Lock(),
+    "delete": Lock(),
+    "digest": Lock(),
+    "evidence": Lock(),
+    "feature": Lock(),
+    "group": Lock(),
+    "image": Lock(),
+    "journal": Lock(),
+    "member": Lock(),
     "message": Lock(),
+    "opencc": Lock(),
+    "pool": Lock(),
+    "qrcode": Lock(),
     "receive": Lock(),
     "regex": Lock(),
+    "save": Lock(),
+    "serial": Lock(),
     "test": Lock(),
-    "text": Lock()
+    "username": Lock()
 }
 
-members: Dict[int, Dict[int, ChatMember]] = {}
+member_events: Dict[Tuple[int, int], Event] = {}
+# member_events = {
+#     (-10012345678, 12345678): Event()
+# }
+
+members: Dict[Tuple[int, int], Tuple[Union[bool, str], float]] = OrderedDict()
 # members = {
-#     -10012345678: {
-#         12345678: ChatMember
-#     }
+#     (-10012345678, 12345678): ("member", 1512345678.0)
 # }
 
+opencc: OpenCC = OpenCC("t2s.json")
+
 other_commands: Set[str] = {
     "admin",
     "admins",
@@ -553,6 +760,32 @@ other_commands: Set[str] = {
     "white"
 }
 
+pools: Dict[str, ThreadPoolExecutor] = {
+    "api": ThreadPoolExecutor(max_workers=16, thread_name_prefix="api"),
+    "check": ThreadPoolExecutor(max_workers=limit_check, thread_name_prefix="check"),
+    "io": ThreadPoolExecutor(max_workers=4, thread_name_prefix="io"),
+    "low": ThreadPoolExecutor(max_workers=4, thread_name_prefix="low")
+}
+
+pool_stats: Dict[str, Dict[str, Union[float, int]]] = {
+    pool: {
+        "pending": 0,
+        "running": 0,
+        "done": 0,
+        "wait": 0.0,
+        "time": 0.0
+    } for pool in pools
+}
+
+# The decoding jobs waiting for the worker threads, each thread runs the jobs in its own worker process
+qrcode_jobs: Queue = Queue()
+
+# The worker threads of decoding start at the first job
+qrcode_workers: List[Thread] = []
+
+# The decoding jobs waiting or running, the checks wait if it is full
+qrcode_slots: BoundedSemaphore = BoundedSemaphore(limit_qrcode * 4)
+
 purged_ids: Set[int] = set()
 # purged_ids = {-10012345678}
 
@@ -598,8 +831,18 @@ regex["adi"] = True
 
 sender: str = "CLEAN"
 
+serials: Dict[Union[int, str], Deque[Tuple[Callable, tuple]]] = {}
+# serials = {
+#     -10012345678: deque([(check_message, (client, message))])
+# }
+
 should_hide: bool = False
 
+t2t_table: Optional[Dict[int, str]] = None
+# t2t_table = {
+#     65: "a"
+# }
+
 types: Dict[str, Union[List[str], Set[str]]] = {
     "all": ["con", "loc", "vdn", "voi",
             "ast", "aud", "bmd", "doc", "gam", "gif", "via", "vid", "ser", "sti",
@@ -610,13 +853,10 @@ types: Dict[str, Union[List[str], Set[str]]] = {
     "spam": {"aff", "emo", "exe", "iml", "pho", "sho", "tgl", "tgp", "qrc", "true"}
 }
 
-usernames: Dict[str, Dict[str, Union[int, str]]] = {}
-# usernames = {
-#     "SCP_079": {
-#         "peer_type": "channel",
-#         "peer_id": -1001196128009
-#     }
-# }
+username_stats: Dict[str, int] = {
+    "hit": 0,
+    "miss": 0
+}
 
 version: str = "0.3.0"
 
@@ -632,6 +872,21 @@ for path in ["data", "tmp"]:
     if not exists(path):
         mkdir(path)
 
+# Init database
+database: Optional[sqlite3.Connection] = None
+
+if storage == "sqlite":
+    database = sqlite3.connect("data/data.db", check_same_thread=False)
+    database.execute("PRAGMA journal_mode = WAL")
+    database.execute("PRAGMA synchronous = NORMAL")
+    database.execute("CREATE TABLE IF NOT EXISTS data (file TEXT, key BLOB, value BLOB, PRIMARY KEY (file, key))")
+    database.commit()
+
+# data rows = [
+#     ("user_ids", b"", pickle.dumps({})),
+#     ("user_ids", pickle.dumps(12345678), pickle.dumps(default_user_status))
+# ]
+
 # Init ids variables
 
 admin_ids: Dict[int, Set[int]] = {}
@@ -761,6 +1016,29 @@ configs: Dict[int, Dict[str, Union[bool, int]]] = {}
 #     }
 # }
 
+images: Dict[str, Dict[str, Union[float, str, None]]] = {}
+# images = {
+#     "AQADW2rWJ10AAzwNAAI": {
+#         "hash": "d41d8cd98f00b204e9800998ecf8427e",
+#         "qrcode": "",
+#         "time": 1512345678.0
+#     },
+#     "d41d8cd98f00b204e9800998ecf8427e": {
+#         "hash": "d41d8cd98f00b204e9800998ecf8427e",
+#         "qrcode": "",
+#         "time": 1512345678.0
+#     }
+# }
+
+usernames: Dict[str, Dict[str, Union[float, int, str]]] = {}
+# usernames = {
+#     "SCP_079": {
+#         "peer_type": "channel",
+#         "peer_id": -1001196128009,
+#         "time": 1512345678.0
+#     }
+# }
+
 # Init word variables
 
 for word_type in regex:
@@ -773,11 +1051,29 @@ for word_type in regex:
 # Load data
 file_list: List[str] = ["admin_ids", "bad_ids", "except_ids", "flooded_ids", "left_group_ids",
                         "message_ids", "trust_ids", "user_ids", "watch_ids", "white_ids",
-                        "configs"]
+                        "configs", "images", "usernames"]
 file_list += [f"{f}_words" for f in regex]
 
+# Changes of these files are appended to journals between snapshots
+journal_list: List[str] = ["images", "message_ids", "user_ids", "usernames"]
+
 for file in file_list:
     try:
+        # Load from the database, the empty key holds the type or the whole value
+        rows = database and database.execute("SELECT key, value FROM data WHERE file = ?", (file,)).fetchall()
+
+        if rows:
+            rows = dict(rows)
+            locals()[f"{file}"] = pickle.loads(rows.pop(b""))
+
+            if isinstance(locals()[f"{file}"], dict):
+                locals()[f"{file}"].update({pickle.loads(k): pickle.loads(v) for k, v in rows.items()})
+
+            continue
+
+        # Migrate the pickle file to the database at the first time
+        database and dirty.add(file)
+
         try:
             if exists(f"data/{file}") or exists(f"data/.{file}"):
                 with open(f"data/{file}", "rb") as f:
@@ -794,6 +1090,35 @@ for file in file_list:
         logger.critical(f"Load data {file} backup error: {e}", exc_info=True)
         raise SystemExit("[DATA CORRUPTION]")
 
+# Replay journals, the old journal is older than the snapshot if the bot stopped right after writing the snapshot
+for file in journal_list:
+    for journal in [f"data/{file}.journal.old", f"data/{file}.journal"]:
+        try:
+            if not exists(journal):
+                continue
+
+            if (journal.endswith(".old") and exists(f"data/{file}")
+                    and getmtime(journal) <= getmtime(f"data/{file}")):
+                remove(journal)
+                continue
+
+            if database and file not in dirty:
+                continue
+
+            with open(journal, "rb") as f:
+                while True:
+                    try:
+                        key, value = pickle.load(f)
+                    except EOFError:
+                        break
+
+                    if value is None:
+                        locals()[f"{file}"].pop(key, None)
+                    else:
+                        locals()[f"{file}"][key] = value
+        except Exception as e:
+            logger.warning(f"Replay journal {journal} error: {e}", exc_info=True)
+
 # Generate special characters dictionary
 for special in ["spc", "spe"]:
     locals()[f"{special}_dict"]: Dict[str, str] = {}
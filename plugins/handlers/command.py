@@ -24,13 +24,13 @@ from subprocess import run, PIPE
 from pyrogram import Client, Filters, Message
 
 from .. import glovar
-from ..functions.channel import ask_for_help, forward_evidence, get_debug_text, send_debug, share_data
+from ..functions.channel import ask_for_help, forward_evidence, get_debug_text, get_group_info, send_debug, share_data
 from ..functions.etc import code, delay, general_link, get_command_context, get_command_type, get_int, get_now
-from ..functions.etc import get_readable_time, lang, mention_id, message_link, thread
+from ..functions.etc import get_pool_text, get_readable_time, lang, mention_id, message_link, thread
 from ..functions.file import save
 from ..functions.filters import authorized_group, from_user, is_class_c, test_group
 from ..functions.group import delete_message, get_config_text
-from ..functions.telegram import delete_messages, get_group_info, send_message, send_report_message
+from ..functions.telegram import delete_messages, send_message, send_report_message
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -84,7 +84,7 @@ def clean(client: Client, message: Message) -> bool:
         for sticker_mid in mids:
             glovar.message_ids[gid]["stickers"].pop(sticker_mid, 0)
 
-        save("message_ids")
+        save("message_ids", gid)
 
         # Generate the report message's text
         text = (f"{lang('admin')}{lang('colon')}{code(aid)}\n"
@@ -174,14 +174,14 @@ def config(client: Client, message: Message) -> bool:
         text = get_debug_text(client, message.chat)
         text += (f"{lang('admin_group')}{lang('colon')}{code(message.from_user.id)}\n"
                  f"{lang('action')}{lang('colon')}{code(lang('config_create'))}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        thread(send_message, (client, glovar.debug_channel_id, text), "low")
 
         return True
     except Exception as e:
         logger.warning(f"Config error: {e}", exc_info=True)
     finally:
         if is_class_c(None, message):
-            delay(3, delete_message, [client, gid, mid])
+            delay(3, delete_messages, [client, gid, [mid]], ("delete", gid))
         else:
             delete_message(client, gid, mid)
 
@@ -267,7 +267,7 @@ def config_directly(client: Client, message: Message) -> bool:
             debug_text += (f"{lang('admin_group')}{lang('colon')}{code(message.from_user.id)}\n"
                            f"{lang('action')}{lang('colon')}{code(lang('config_change'))}\n"
                            f"{lang('more')}{lang('colon')}{code(f'{command_type} {command_context}')}\n")
-            thread(send_message, (client, glovar.debug_channel_id, debug_text))
+            thread(send_message, (client, glovar.debug_channel_id, debug_text), "low")
 
         text += (f"{lang('action')}{lang('colon')}{code(lang('config_change'))}\n"
                  f"{lang('status')}{lang('colon')}{code(reason)}\n")
@@ -475,7 +475,7 @@ def purge_begin(client: Client, message: Message) -> bool:
         r_mid = r_message.message_id
         now = message.date or get_now()
         glovar.message_ids[gid]["purge"] = (r_mid, now)
-        save("message_ids")
+        save("message_ids", gid)
 
         # Generate the report message's text
         aid = message.from_user.id
@@ -556,7 +556,7 @@ def purge_end(client: Client, message: Message) -> bool:
         glovar.purged_ids.add(gid)
         thread(delete_messages, (client, gid, range(bid, eid + 1)))
         glovar.message_ids[gid]["purge"] = (0, 0)
-        save("message_ids")
+        save("message_ids", gid)
 
         # Generate the report message's text
         aid = message.from_user.id
@@ -618,6 +618,9 @@ def version(client: Client, message: Message) -> bool:
         get_hash_link = f"https://github.com/scp-079/scp-079-{glovar.sender.lower()}/commit/{git_hash}"
         command_date = get_readable_time(message.date, "%Y/%m/%d %H:%M:%S")
 
+        # Username cache stats
+        username_text = f"hit {glovar.username_stats['hit']}, miss {glovar.username_stats['miss']}"
+
         # Generate the text
         text = (f"{lang('admin')}{lang('colon')}{mention_id(aid)}\n\n"
                 f"{lang('project')}{lang('colon')}{code(glovar.sender)}\n"
@@ -625,7 +628,9 @@ def version(client: Client, message: Message) -> bool:
                 f"{lang('本地修改')}{lang('colon')}{code(git_change)}\n"
                 f"{lang('哈希值')}{lang('colon')}{general_link(git_hash, get_hash_link)}\n"
                 f"{lang('提交时间')}{lang('colon')}{code(git_date)}\n"
-                f"{lang('命令发送时间')}{lang('colon')}{code(command_date)}\n")
+                f"{lang('命令发送时间')}{lang('colon')}{code(command_date)}\n\n"
+                f"{get_pool_text()}"
+                f"{lang('用户名缓存')}{lang('colon')}{code(username_text)}\n")
 
         # Send the report message
         result = send_message(client, cid, text, mid)
@@ -21,15 +21,15 @@ import logging
 from pyrogram import Client, Filters, Message
 
 from .. import glovar
-from ..functions.channel import get_content, get_debug_text
+from ..functions.channel import get_content, get_debug_text, get_group
 from ..functions.etc import code, delay, general_link, get_filename, get_forward_name, get_full_name, get_now, get_text
-from ..functions.etc import lang, mention_id, t2t, thread
+from ..functions.etc import lang, mention_id, serial, t2t, thread
 from ..functions.file import save
 from ..functions.filters import aio, authorized_group, class_d, declared_message, exchange_channel, from_user
 from ..functions.filters import hide_channel, is_ban_text, is_bio_text, is_class_d_user, is_declared_message
 from ..functions.filters import is_high_score_user, is_in_config, is_limited_user, is_nm_text, is_not_allowed
 from ..functions.filters import is_regex_text, is_watch_user, new_group, test_group
-from ..functions.group import delete_message, leave_group
+from ..functions.group import leave_group
 from ..functions.ids import init_group_id, init_user_id
 from ..functions.receive import receive_add_bad, receive_add_except, receive_captcha_flood, receive_captcha_kicked_user
 from ..functions.receive import receive_captcha_kicked_users, receive_config_commit, receive_clear_data
@@ -38,10 +38,10 @@ from ..functions.receive import receive_flood_score, receive_preview, receive_le
 from ..functions.receive import receive_refresh, receive_remove_bad, receive_remove_except, receive_remove_score
 from ..functions.receive import receive_remove_watch, receive_remove_white, receive_rollback, receive_text_data
 from ..functions.receive import receive_user_score, receive_watch_user, receive_white_users
-from ..functions.telegram import get_admins, get_user_bio, send_message
+from ..functions.telegram import delete_messages, get_admins, get_user_bio, send_message
 from ..functions.tests import clean_test
 from ..functions.timers import backup_files, send_count
-from ..functions.user import terminate_user
+from ..functions.user import terminate_qrcode, terminate_user
 
 # Enable logging
 logger = logging.getLogger(__name__)
@@ -52,20 +52,26 @@ logger = logging.getLogger(__name__)
                    & from_user & ~class_d
                    & ~declared_message)
 def check(client: Client, message: Message) -> bool:
-    # Check the messages sent from groups
+    # Check the messages sent from groups, different groups are checked in parallel
+    try:
+        return serial(message.chat.id, check_message, (client, message))
+    except Exception as e:
+        logger.warning(f"Check error: {e}", exc_info=True)
 
-    has_text = bool(message and (message.text or message.caption))
+    return False
 
-    if has_text:
-        glovar.locks["text"].acquire()
-    else:
-        glovar.locks["message"].acquire()
 
+def check_message(client: Client, message: Message) -> bool:
+    # Check a message, the messages of the same group are checked in order
     try:
         # Basic data
         gid = message.chat.id
         now = message.date or get_now()
 
+        # Refresh the group's metadata
+        if message.pinned_message or message.new_chat_title:
+            get_group(client, gid, False)
+
         # Work with NOSPAM
         if glovar.nospam_id in glovar.admin_ids[gid]:
             # Check the forward from name
@@ -131,7 +137,11 @@ def check(client: Client, message: Message) -> bool:
 
         # Not allowed message
         content = get_content(message)
-        detection = is_not_allowed(client, message)
+        detection = is_not_allowed(
+            client=client,
+            message=message,
+            later=lambda qrcode: terminate_qrcode(client, message, content, qrcode)
+        )
 
         if detection:
             result = terminate_user(client, message, detection)
@@ -145,12 +155,7 @@ def check(client: Client, message: Message) -> bool:
 
         return True
     except Exception as e:
-        logger.warning(f"Check error: {e}", exc_info=True)
-    finally:
-        if has_text:
-            glovar.locks["text"].release()
-        else:
-            glovar.locks["message"].release()
+        logger.warning(f"Check message error: {e}", exc_info=True)
 
     return False
 
@@ -207,21 +212,21 @@ def check_join(client: Client, message: Message) -> bool:
 
             # Update user's join status
             glovar.user_ids[uid]["join"][gid] = now
-            save("user_ids")
+            save("user_ids", uid)
 
         # Delete service message
         if not is_in_config(gid, "ser"):
             return True
 
         if glovar.configs[gid].get("clean") and glovar.captcha_id not in glovar.admin_ids[gid]:
-            delay(10, delete_message, [client, gid, mid])
+            delay(10, delete_messages, [client, gid, [mid]], ("delete", gid))
             return True
 
         if glovar.message_ids[gid]["service"]:
-            delay(10, delete_message, [client, gid, glovar.message_ids[gid]["service"]])
+            delay(10, delete_messages, [client, gid, [glovar.message_ids[gid]["service"]]], ("delete", gid))
 
         glovar.message_ids[gid]["service"] = mid
-        save("message_ids")
+        save("message_ids", gid)
 
         result = True
     except Exception as e:
@@ -268,7 +273,7 @@ def exchange_emergency(client: Client, message: Message) -> bool:
         text = (f"{lang('project')}{lang('colon')}{project_text}\n"
                 f"{lang('action')}{lang('colon')}{code(lang('transfer_channel'))}\n"
                 f"{lang('emergency_channel')}{lang('colon')}{code(hide_text)}\n")
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        thread(send_message, (client, glovar.debug_channel_id, text), "low")
 
         return True
     except Exception as e:
@@ -342,7 +347,7 @@ def init_group(client: Client, message: Message) -> bool:
             text += f"{lang('inviter')}{lang('colon')}{code(inviter.id)}\n"
 
         # Send debug message
-        thread(send_message, (client, glovar.debug_channel_id, text))
+        thread(send_message, (client, glovar.debug_channel_id, text), "low")
 
         return True
     except Exception as e:
@@ -445,7 +450,7 @@ def process_data(client: Client, message: Message) -> bool:
 
                 elif action == "backup":
                     if action_type == "now":
-                        thread(backup_files, (client,))
+                        thread(backup_files, (client,), "io")
                     elif action_type == "rollback":
                         receive_rollback(client, message, data)
 
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# SCP-079-CLEAN - Filter specific types of messages
+# Copyright (C) 2019-2020 SCP-079 <https://scp-079.org>
+#
+# This file is part of SCP-079-CLEAN.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import sys
+from io import BytesIO
+from os import walk
+from os.path import join
+from time import time
+
+from PIL import Image
+
+from plugins.functions.decode import decode_qrcode, screen_qrcode
+
+# Measure the pre-screening of QR codes against the full decoding on the local images
+# Usage: python3 screen.py <directory of images>
+
+
+def measure(path: str) -> dict:
+    # Screen and fully decode the image, the full decoding is the ground truth
+    with open(path, "rb") as f:
+        data = f.read()
+
+    # Raise the error of the file that is not an image
+    Image.open(BytesIO(data)).verify()
+
+    start = time()
+    screened = screen_qrcode(data)
+    middle = time()
+    decoded = bool(decode_qrcode(data))
+    end = time()
+
+    return {
+        "path": path,
+        "screened": screened,
+        "decoded": decoded,
+        "screen_time": middle - start,
+        "decode_time": end - middle
+    }
+
+
+def report(results: list) -> str:
+    # Get the text of the precision, the recall and the time
+    total = len(results)
+    tp = sum(r["screened"] and r["decoded"] for r in results)
+    fp = sum(r["screened"] and not r["decoded"] for r in results)
+    fn = sum(not r["screened"] and r["decoded"] for r in results)
+    skipped = total - tp - fp
+    screen_time = sum(r["screen_time"] for r in results)
+    decode_time = sum(r["decode_time"] for r in results)
+    screened_time = screen_time + sum(r["decode_time"] for r in results if r["screened"])
+    missed = [r["path"] for r in results if not r["screened"] and r["decoded"]]
+
+    text = (f"Images: {total}, with QR code: {tp + fn}\n"
+            f"Escalated: {tp + fp}, skipped: {skipped} ({skipped / total:.1%})\n"
+            f"Precision: {tp / (tp + fp) if tp + fp else 0:.3f}, recall: {tp / (tp + fn) if tp + fn else 1:.3f}\n"
+            f"Screen: {screen_time / total * 1000:.2f} ms/image, decode: {decode_time / total * 1000:.2f} ms/image\n"
+            f"Time with screening: {screened_time / total * 1000:.2f} ms/image")
+
+    if missed:
+        text += "\nMissed:\n" + "\n".join(missed)
+
+    return text
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python3 screen.py <directory of images>")
+        sys.exit(1)
+
+    paths = sorted(join(root, name) for root, _, names in walk(sys.argv[1]) for name in names)
+    results = []
+
+    for image_path in paths:
+        try:
+            results.append(measure(image_path))
+        except Exception as e:
+            print(f"Skip {image_path}: {e}")
+
+    if not results:
+        print("No image")
+        sys.exit(1)
+
+    print(report(results))